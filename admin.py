@@ -11,7 +11,7 @@ from transwarp.web import ctx, view, get, post, route, Dict, UTC, Template, seeo
 from transwarp import db, i18n, cache
 
 from apiexporter import *
-import loader, async
+import loader, async, counter
 
 for the_name, the_mod in loader.scan_submodules('apps').iteritems():
     the_path = os.path.dirname(os.path.abspath(the_mod.__file__))
@@ -163,6 +163,5 @@ def admin_menu_item(mod, handler):
 def track_js():
     ctx.response.content_type = 'application/x-javascript'
     ctx.response.set_header('Cache-Control', 'private, no-cache, no-cache=Set-Cookie, proxy-revalidate')
-    key = 'counter_%s_%d' % (ctx.website.id, int(time.time()) // 3600)
-    cache.client.incr(key)
+    counter.inc_rollups('traffic_%s' % ctx.website.id)
     return r'var __track_ok__ = true;'
@@ -8,7 +8,7 @@ try:
 except ImportError:
     import simplejson as json
 
-import re, logging, functools
+import re, time, logging, functools, threading
 
 from transwarp.web import ctx, get, post, forbidden, HttpError, Dict
 from transwarp import db, cache
@@ -57,12 +57,96 @@ class APIPermissionError(APIError):
     def __init__(self, message=''):
         super(APIPermissionError, self).__init__('permission:forbidden', 'permission', message)
 
-def cached(key=None, timeout=3600, use_ctx=True):
+_LOCK_KEY = '__LOCK__@%s:%d'
+_LOCK_TIMEOUT = 10
+_LOCK_MAX_WAIT = 3
+
+# keys being computed in process as key -> threading.Event:
+_flights = dict()
+_flights_lock = threading.Lock()
+
+def acquire_lock(key):
+    '''
+    Try to acquire lock of key across processes by cache. Returns lock key if
+    acquired, or None. The lock key is created with timeout by one call, and
+    contains time slot so a lock that was not released expires after
+    _LOCK_TIMEOUT seconds at most.
+    '''
+    lk = _LOCK_KEY % (key, int(time.time() / _LOCK_TIMEOUT))
+    if cache.client.incrs({lk: 1}, _LOCK_TIMEOUT)[0]==1:
+        return lk
+    return None
+
+def release_lock(lk):
+    ' release lock by lock key returned by acquire_lock(). '
+    cache.client.delete(lk)
+
+def wait_cached(key, max_wait=_LOCK_MAX_WAIT):
+    '''
+    Wait until value of key is cached by other caller, with backoff from 50 ms
+    to 800 ms between gets. Returns the value, or None after max_wait seconds.
+    '''
+    expires = time.time() + max_wait
+    wait = 0.05
+    while True:
+        time.sleep(min(wait, max(expires - time.time(), 0)))
+        r = cache.client.get(key)
+        if r is not None or time.time() >= expires:
+            return r
+        wait = min(wait * 2, 0.8)
+
+def _compute(func, args, key, timeout):
+    r = func(*args)
+    cache.client.set(key, r, timeout)
+    return r
+
+def _single_flight(func, args, key, timeout):
+    '''
+    Get cached value, or compute it by only one caller. Other callers wait until
+    the value is cached, and compute it by themselves after _LOCK_MAX_WAIT
+    seconds. No lock is held while computing or waiting, so single-flight
+    functions can call each other.
+    '''
+    r = cache.client.get(key)
+    if r is not None:
+        return r
+    # elect one thread of this process as leader of key:
+    with _flights_lock:
+        event = _flights.get(key)
+        leader = event is None
+        if leader:
+            event = _flights[key] = threading.Event()
+    if not leader:
+        event.wait(_LOCK_MAX_WAIT)
+        r = cache.client.get(key)
+    else:
+        try:
+            lk = acquire_lock(key)
+            if lk is not None:
+                try:
+                    return _compute(func, args, key, timeout)
+                finally:
+                    release_lock(lk)
+            # other process is computing:
+            r = wait_cached(key)
+        finally:
+            with _flights_lock:
+                _flights.pop(key, None)
+            event.set()
+    if r is None:
+        logging.warning('Wait for cache timeout: %s' % key)
+        return _compute(func, args, key, timeout)
+    return r
+
+def cached(key=None, timeout=3600, use_ctx=True, single_flight=False):
     '''
     Make function result cached. the cache key is:
       non-arg function: 'WebsiteId--FunctionName'
       args function: 'WebsiteId--FunctionName--Arg1--Arg2--ArgN'
 
+    If single_flight is True, only one caller across processes computes the
+    missing value while others wait for it.
+
     >>> import time
     >>> @cached(timeout=2)
     ... def get_time():
@@ -76,6 +160,14 @@ def cached(key=None, timeout=3600, use_ctx=True):
     >>> n3 = get_time()
     >>> n1==n3
     False
+    >>> @cached(use_ctx=False, single_flight=True)
+    ... def inner(x):
+    ...     return 'inner-%s' % x
+    >>> @cached(use_ctx=False, single_flight=True)
+    ... def outer(x):
+    ...     return 'outer-%s' % inner(x)
+    >>> outer('a')
+    'outer-inner-a'
     '''
     def _decorator(func):
         @functools.wraps(func)
@@ -86,6 +178,8 @@ def cached(key=None, timeout=3600, use_ctx=True):
                 L = [s]
                 L.extend(args)
                 s = '--'.join(L)
+            if single_flight:
+                return _single_flight(func, args, s, timeout)
             r = cache.client.get(s)
             if r is None:
                 logging.debug('Cache not found for key: %s' % s)
@@ -202,7 +296,8 @@ def check_email(email):
     return e
 
 if __name__=='__main__':
-    cache.client = cache.RedisClient('localhost')
+    import localcache
+    cache.client = localcache.LocalClient()
     ctx.website = Dict(id='123000')
     import doctest
     doctest.testmod()
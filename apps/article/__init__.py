@@ -4,16 +4,16 @@
 __author__ = 'Michael Liao'
 
 import os, time, logging, mimetypes
-from datetime import datetime
 
-from transwarp.web import ctx, get, post, route, seeother, Template, Dict, UTC_0
+from transwarp.web import ctx, get, post, route, seeother, notfound, Template, Dict
 from transwarp import db
 
 from apiexporter import *
 from plugin import store
-import html, thumbnail, setting, counter
+import html, thumbnail, setting, counter, pagecache, util, feed, rowcache
 
 from plugin.theme import theme
+from conditional import conditional
 
 from apps import menu
 
@@ -22,7 +22,9 @@ from apps import menu
 ################################################################################
 
 def _get_category(category_id):
-    cat = db.select_one('select * from categories where id=?', category_id)
+    cat = rowcache.get('categories', category_id)
+    if cat is None:
+        raise notfound()
     if cat.website_id != ctx.website.id:
         raise APIPermissionError('cannot get category that does not belong to current website.')
     return cat
@@ -88,6 +90,7 @@ def api_create_category():
             creation_time=current, modified_time=current, \
             version=0)
     db.insert('categories', **cat)
+    pagecache.bump()
     return cat
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -103,6 +106,8 @@ def api_update_category():
     logging.info('update category...')
     cat = _get_category(i.id)
     db.update_kw('categories', 'id=?', i.id, name=name, description=description, modified_time=time.time(), version=cat.version+1)
+    rowcache.delete('categories', i.id)
+    pagecache.bump()
     return True
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -115,8 +120,12 @@ def api_delete_category():
     if cat.locked:
         raise APIError('operation:failed', 'category', 'cannot delete category that is locked.')
     uncategorized = db.select_one('select id from categories where website_id=? and locked=?', ctx.website.id, True)
+    article_ids = [a.id for a in db.select('select id from articles where category_id=?', i.id)]
     db.update('delete from categories where id=?', i.id)
     db.update('update articles set category_id=?, version=version + 1 where category_id=?', uncategorized.id, i.id)
+    rowcache.delete('categories', i.id)
+    rowcache.delete('articles', *article_ids)
+    pagecache.bump()
     return True
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -128,22 +137,24 @@ def api_sort_categories():
     if l != len(ids):
         raise APIValueError('id', 'bad id list.')
     sets = set([c.id for c in cats])
-    odict = dict()
-    n = 0
     for o in ids:
         if not o in sets:
             raise APIValueError('id', 'some id was invalid.')
-        odict[o] = n
-        n = n + 1
     with db.transaction():
-        for c in cats:
-            db.update('update categories set display_order=?, version=version + 1 where id=?', odict.get(c.id, l), c.id)
+        util.reorder('categories', cats, ids, sets='version = version + 1')
+    rowcache.delete('categories', *ids)
+    pagecache.bump()
     return True
 
-@theme('category.html')
+def _website_validator(*args, **kw):
+    ' validator for pages that only changed with website generation. '
+    return (), None
+
+@theme('category.html', page_cache=True)
+@conditional(_website_validator)
 @route('/category/<category_id>')
 def theme_articles_by_category(category_id):
-    i = ctx.request.input(page='1', size='20')
+    i = ctx.request.input(page='1', size='20', after='', before='')
     page = int(i.page)
     size = int(i.size)
     if page < 1:
@@ -151,37 +162,33 @@ def theme_articles_by_category(category_id):
     if size < 1 or size > 100:
         raise APIValueError('size', 'size invalid.')
     category = _get_category(category_id)
-    articles = _get_articles_by_category(category_id, page=page, limit=size+1, published_only=True)
-    next = len(articles)==size+1
-    if next:
-        articles = articles[:-1]
+    articles, paging = _get_articles_by_category(category_id, page=page, size=size, published_only=True, after=i.after, before=i.before)
+    _add_read_counts(articles)
     categories = _get_categories()
     category_dict = dict()
     for cat in categories:
         category_dict[cat.id] = cat.name
-    return dict(__navigation__=('/category/%s' % category_id, '/articles'), category=category, articles=articles, page=page, previous=page>2, next=next, categories=categories, get_category_name=lambda cid: category_dict.get(cid, 'ERROR'))
+    return dict(__navigation__=('/category/%s' % category_id, '/articles'), category=category, articles=articles, categories=categories, get_category_name=lambda cid: category_dict.get(cid, 'ERROR'), **paging)
 
 ################################################################################
 # Articles
 ################################################################################
 
+# columns of article listings, without content which is loaded only when a
+# single article is rendered:
+_ARTICLE_COLUMNS = 'id, website_id, user_id, category_id, draft, user_name, name, tags, read_count, summary, creation_time, modified_time, version'
+
 @menu(ROLE_SUBSCRIBERS, 'Articles', 'All Articles', name_order=2)
 def articles():
-    i = ctx.request.input(action='', page='1')
+    i = ctx.request.input(action='', page='1', after='', before='')
     if i.action=='edit':
         article = _get_article(i.id)
         return Template('templates/articleform.html', form_title=_('Edit Article'), form_action='/api/articles/update', categories=_get_categories(), static=False, **article)
     if i.action=='delete':
         api_delete_article()
         raise seeother('articles')
-    page = int(i.page)
-    previous = page > 1
-    next = False
-    articles = _get_articles(page, 51, published_only=False)
-    if len(articles)==51:
-        articles = articles[:-1]
-        next = True
-    return Template('templates/articles.html', page=page, previous=previous, next=next, categories=_get_categories(), articles=articles)
+    articles, paging = _get_articles(int(i.page), 50, published_only=False, after=i.after, before=i.before)
+    return Template('templates/articles.html', categories=_get_categories(), articles=articles, **paging)
 
 @menu(ROLE_CONTRIBUTORS, 'Articles', 'Add Article', name_order=3)
 def add_article():
@@ -193,7 +200,9 @@ def _format_tags(tags):
     return u''
 
 def _get_article(article_id):
-    article = db.select_one('select * from articles where id=?', article_id)
+    article = rowcache.get('articles', article_id)
+    if article is None:
+        raise notfound()
     if article.website_id != ctx.website.id:
         raise APIPermissionError('cannot get article that does not belong to current website.')
     if article.draft and (ctx.user is None or ctx.user.role_id==ROLE_GUESTS):
@@ -205,17 +214,23 @@ def _count_articles(published_only=True):
         return db.select_int('select count(id) from articles where website_id=? and draft=?', ctx.website.id, False)
     return db.select_int('select count(id) from articles where website_id=?', ctx.website.id)
 
-def _get_articles(page=1, limit=20, published_only=True):
-    offset = (page - 1) * limit
+def _get_articles(page=1, size=20, published_only=True, after=None, before=None):
+    ' get articles and paging info by page index, or by cursor after or before. '
     if published_only:
-        return db.select('select * from articles where website_id=? and draft=? order by id desc limit ?,?', ctx.website.id, False, offset, limit)
-    return db.select('select * from articles where website_id=? order by id desc limit ?,?', ctx.website.id, offset, limit)
+        return util.select_page('articles', 'website_id=? and draft=?', [ctx.website.id, False], size, page, after, before, columns=_ARTICLE_COLUMNS)
+    return util.select_page('articles', 'website_id=?', [ctx.website.id], size, page, after, before, columns=_ARTICLE_COLUMNS)
 
-def _get_articles_by_category(category_id, page=1, limit=20, published_only=True):
-    offset = (page - 1) * limit
+def _add_read_counts(articles):
+    ' add counts that are not folded into read_count yet, by one cache call. '
+    if articles:
+        for a, n in zip(articles, counter.counts(*[a.id for a in articles])):
+            a.read_count = a.read_count + int(n or 0)
+
+def _get_articles_by_category(category_id, page=1, size=20, published_only=True, after=None, before=None):
+    ' get articles of category and paging info by page index, or by cursor after or before. '
     if published_only:
-        return db.select('select * from articles where category_id=? and draft=? order by id desc limit ?,?', category_id, False, offset, limit)
-    return db.select('select * from articles where category_id=? order by id desc limit ?,?', category_id, offset, limit)
+        return util.select_page('articles', 'category_id=? and draft=?', [category_id, False], size, page, after, before, columns=_ARTICLE_COLUMNS)
+    return util.select_page('articles', 'category_id=?', [category_id], size, page, after, before, columns=_ARTICLE_COLUMNS)
 
 @api(role=ROLE_GUESTS)
 @get('/api/articles/get')
@@ -241,7 +256,7 @@ def api_count_articles():
 @api(role=ROLE_GUESTS)
 @get('/api/articles/list')
 def api_list_articles():
-    i = ctx.request.input(page='1', size='20', published_only='true')
+    i = ctx.request.input(page='1', size='20', published_only='true', after='', before='')
     page = int(i.page)
     size = int(i.size)
     if page < 1:
@@ -249,10 +264,9 @@ def api_list_articles():
     if size < 1 or size > 100:
         raise APIValueError('size', 'size invalid.')
     published_only = ctx.user is None or ctx.user.role_id==ROLE_GUESTS or boolean(i.published_only)
-    articles = _get_articles(page=page, limit=size+1, published_only=published_only)
-    if len(articles)==size+1:
-        return dict(articles=articles[:-1], page=page, previous=page>2, next=True)
-    return dict(articles=articles, page=page, previous=page>2, next=False)
+    articles, paging = _get_articles(page=page, size=size, published_only=published_only, after=i.after, before=i.before)
+    _add_read_counts(articles)
+    return dict(articles=articles, **paging)
 
 @api(role=ROLE_CONTRIBUTORS)
 @post('/api/articles/create')
@@ -289,6 +303,8 @@ def api_create_article():
         modified_time=current, \
         version=0)
     db.insert('articles', **article)
+    html.save_html('articles', article.id, article.version, content)
+    pagecache.bump()
     return article
 
 @api(role=ROLE_CONTRIBUTORS)
@@ -327,6 +343,9 @@ def api_update_article():
         kw['modified_time'] = time.time()
         kw['version'] = article.version + 1
         db.update_kw('articles', 'id=?', i.id, **kw)
+        rowcache.delete('articles', i.id)
+        html.save_html('articles', i.id, kw['version'], kw.get('content', article.content))
+        pagecache.bump()
     return True
 
 @api(role=ROLE_AUTHORS)
@@ -339,46 +358,57 @@ def api_delete_article():
     if ctx.user.role_id == ROLE_AUTHORS and article.user_id != ctx.user.id:
         raise APIPermissionError('cannot delete article that belong to other')
     db.update('delete from articles where id=?', i.id)
+    rowcache.delete('articles', i.id)
+    html.delete_html(i.id)
+    pagecache.bump()
     return True
 
-@theme('article.html')
+def _article_validator(article_id):
+    r = rowcache.get('articles', article_id)
+    if r is None or r.website_id != ctx.website.id or r.draft:
+        return None
+    return (article_id, r.version), r.modified_time
+
+@theme('article.html', page_cache=True)
+@conditional(_article_validator)
 @route('/article/<article_id>')
 def theme_get_article(article_id):
     article = _get_article(article_id)
-    # todo: cache article content:
-    article.content = html.to_html(article)
+    article.content = html.to_html(article, 'articles')
     # increase counter:
-    article.read_count = article.read_count + counter.inc(article.id)
+    article.read_count = article.read_count + counter.inc(article.id, 'articles')
     categories = _get_categories()
     category_dict = dict()
     for cat in categories:
         category_dict[cat.id] = cat.name
-    return dict(__navigation__=('/category/%s' % article.category_id, '/articles'), article=article, categories=categories, get_category_name=lambda cid: category_dict.get(cid, 'ERROR'))
+    return dict(__navigation__=('/category/%s' % article.category_id, '/articles'), __counters__=((article.id, 'articles'),), article=article, categories=categories, get_category_name=lambda cid: category_dict.get(cid, 'ERROR'))
 
-@theme('articles.html')
+@theme('articles.html', page_cache=True)
+@conditional(_website_validator)
 @route('/articles')
 def theme_get_articles():
-    i = ctx.request.input(page='1', size='20')
+    i = ctx.request.input(page='1', size='20', after='', before='')
     page = int(i.page)
     size = int(i.size)
     if page < 1:
         raise APIValueError('page', 'page invalid.')
     if size < 1 or size > 100:
         raise APIValueError('size', 'size invalid.')
-    articles = _get_articles(page=page, limit=size+1, published_only=True)
-    next = len(articles)==size+1
-    if next:
-        articles = articles[:-1]
+    articles, paging = _get_articles(page=page, size=size, published_only=True, after=i.after, before=i.before)
+    _add_read_counts(articles)
     categories = _get_categories()
     category_dict = dict()
     for cat in categories:
         category_dict[cat.id] = cat.name
-    return dict(__navigation__=('/articles',), articles=articles, page=page, previous=(page>1), next=next, categories=categories, get_category_name=lambda cid: category_dict.get(cid, 'ERROR'))
+    return dict(__navigation__=('/articles',), articles=articles, categories=categories, get_category_name=lambda cid: category_dict.get(cid, 'ERROR'), **paging)
 
 ################################################################################
 # Pages
 ################################################################################
 
+# columns of page listings, without content:
+_PAGE_COLUMNS = 'id, website_id, draft, name, tags, read_count, creation_time, modified_time, version'
+
 @menu(ROLE_SUBSCRIBERS, 'Pages', 'All Pages', group_order=20, name_order=1)
 def pages():
     i = ctx.request.input(action='')
@@ -395,7 +425,9 @@ def add_page():
     return Template('templates/articleform.html', form_title=_('Add Page'), form_action='/api/pages/create', static=True)
 
 def _get_page(page_id):
-    page = db.select_one('select * from pages where id=?', page_id)
+    page = rowcache.get('pages', page_id)
+    if page is None:
+        raise notfound()
     if page.website_id != ctx.website.id:
         raise APIPermissionError('cannot get page that does not belong to current website.')
     if page.draft and (ctx.user is None or ctx.user.role_id==ROLE_GUESTS):
@@ -404,8 +436,8 @@ def _get_page(page_id):
 
 def _get_pages(published_only=True):
     if published_only:
-        return db.select('select * from pages where website_id=? and draft=? order by id desc', ctx.website.id, False)
-    return db.select('select * from pages where website_id=? order by id desc', ctx.website.id)
+        return db.select('select %s from pages where website_id=? and draft=? order by id desc' % _PAGE_COLUMNS, ctx.website.id, False)
+    return db.select('select %s from pages where website_id=? order by id desc' % _PAGE_COLUMNS, ctx.website.id)
 
 @api(role=ROLE_GUESTS)
 @get('/api/pages/list')
@@ -452,6 +484,8 @@ def api_create_page():
         modified_time=current, \
         version=0)
     db.insert('pages', **page)
+    html.save_html('pages', page.id, page.version, content)
+    pagecache.bump()
     return page
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -478,7 +512,11 @@ def api_update_page():
         kw['draft'] = boolean(i.draft)
     if kw:
         kw['modified_time'] = time.time()
+        kw['version'] = page.version + 1
         db.update_kw('pages', 'id=?', i.id, **kw)
+        rowcache.delete('pages', i.id)
+        html.save_html('pages', i.id, kw['version'], kw.get('content', page.content))
+        pagecache.bump()
     return True
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -489,17 +527,27 @@ def api_delete_page():
         raise APIValueError('id', 'id cannot be empty.')
     page = _get_page(i.id)
     db.update('delete from pages where id=?', i.id)
+    rowcache.delete('pages', i.id)
+    html.delete_html(i.id)
+    pagecache.bump()
     return True
 
-@theme('page.html')
+def _page_validator(page_id):
+    r = rowcache.get('pages', page_id)
+    if r is None or r.website_id != ctx.website.id or r.draft:
+        return None
+    return (page_id, r.version), r.modified_time
+
+@theme('page.html', page_cache=True)
+@conditional(_page_validator)
 @route('/page/<page_id>')
 def theme_get_page(page_id):
     page = _get_page(page_id)
-    page.content = html.to_html(page)
+    page.content = html.to_html(page, 'pages')
     # increase counter:
-    page.read_count = page.read_count + counter.inc(page.id)
+    page.read_count = page.read_count + counter.inc(page.id, 'pages')
     categories = _get_categories()
-    return dict(__navigation__=('/page/%s' % page_id,), page=page, categories=categories)
+    return dict(__navigation__=('/page/%s' % page_id,), __counters__=((page.id, 'pages'),), page=page, categories=categories)
 
 ################################################################################
 # Attachments
@@ -576,7 +624,7 @@ def add_attachment():
 
 @menu(ROLE_SUBSCRIBERS, 'Attachments', 'All Attachments', group_order=40, name_order=1)
 def attachments():
-    i = ctx.request.input(action='', page='1', size='20')
+    i = ctx.request.input(action='', page='1', size='20', after='', before='')
     if i.action=='delete':
         delete_attachment(i.id)
         raise seeother('attachments')
@@ -587,13 +635,8 @@ def attachments():
         raise APIValueError('page', 'page invalid.')
     if size < 1 or size > 100:
         raise APIValueError('size', 'size invalid.')
-    offset = (page - 1) * size
-    atts = db.select('select * from attachments where website_id=? order by id desc limit ?,?', ctx.website.id, offset, size+1)
-    next = False
-    if len(atts)>size:
-        atts = atts[:-1]
-        next = True
-    return Template('templates/attachments.html', attachments=atts, page=page, previous=page>2, next=next)
+    atts, paging = util.select_page('attachments', 'website_id=?', [ctx.website.id], size, page, i.after, i.before)
+    return Template('templates/attachments.html', attachments=atts, **paging)
 
 ################################################################################
 # Navigations
@@ -658,59 +701,71 @@ def comment():
 
 '''
 
-def _rss_datetime(ts):
-    dt = datetime.fromtimestamp(ts, UTC_0)
-    return dt.strftime('%a, %d %b %Y %H:%M:%S GMT')
-
-def _safe_str(s):
-    if isinstance(s, str):
-        return s
-    if isinstance(s, unicode):
-        return s.encode('utf-8')
-    return str(s)
-
-@cached(key='article/feed', timeout=900)
+def _feed_validator(category_id=None):
+    '''
+    Feeds are validated by page generation of website only, which is in the
+    ETag and is bumped by any write of articles and categories, including
+    deletes. No Last-Modified is sent and no db query is made.
+    '''
+    if category_id:
+        cat = rowcache.get('categories', category_id)
+        if cat is None or cat.website_id != ctx.website.id:
+            return None
+        return (category_id,), None
+    return (), None
+
+@conditional(_feed_validator, use_theme=False)
 @get('/feed')
 def rss():
-    ctx.response.content_type = 'application/rss+xml'
-    limit = 20
+    return _feed('rss')
+
+@conditional(_feed_validator, use_theme=False)
+@get('/feed/atom')
+def atom():
+    return _feed('atom')
+
+@conditional(_feed_validator, use_theme=False)
+@get('/feed/category/<category_id>')
+def rss_by_category(category_id):
+    return _feed('rss', _get_category(category_id))
+
+@conditional(_feed_validator, use_theme=False)
+@get('/feed/category/<category_id>/atom')
+def atom_by_category(category_id):
+    return _feed('atom', _get_category(category_id))
+
+def _feed(fmt, category=None):
+    '''
+    Get feed as generator of str, or list of str if cached. The cached feed is
+    invalidated by page generation of website, which is bumped by any write of
+    articles and categories.
+    '''
+    ctx.response.content_type = 'application/atom+xml' if fmt=='atom' else 'application/rss+xml'
+    name = '%s/%s' % (category.id if category else 'all', fmt)
+    return feed.cached_feed(name, pagecache.get_generation(), lambda: _make_feed(fmt, category))
+
+def _make_feed(fmt, category=None):
+    ' load articles and make feed generator. '
     ss = setting.get_website_settings()
-    description = ss['description']
-    copyright = ss['copyright']
     domain = ctx.website.domain
-    articles = _get_articles(1, 20)
-    rss_time = articles and articles[0].creation_time or time.time()
-    L = [
-        '<?xml version="1.0"?>\n<rss version="2.0"><channel><title><![CDATA[',
-        ctx.website.name,
-        ']]></title><link>http://',
-        domain,
-        '/</link><description><![CDATA[',
-        description,
-        ']]></description><lastBuildDate>',
-        _rss_datetime(rss_time),
-        '</lastBuildDate><generator>iTranswarp</generator><ttl>30</ttl>'
-    ]
-    for a in articles:
-        L.append('<item><title><![CDATA[')
-        L.append(a.name)
-        L.append(']]></title><link>http://')
-        L.append(domain)
-        L.append('/article/')
-        L.append(a.id)
-        L.append('</link><guid>http://')
-        L.append(domain)
-        L.append('/article/')
-        L.append(a.id)
-        L.append('</guid><author><![CDATA[')
-        L.append(a.user_name)
-        L.append(']]></author><pubDate>')
-        L.append(_rss_datetime(a.creation_time))
-        L.append('</pubDate><description><![CDATA[')
-        L.append(html.to_html(a))
-        L.append(']]></description></item>')
-    L.append(r'</channel></rss>')
-    return map(_safe_str, L)
+    if category:
+        articles, paging = _get_articles_by_category(category.id, 1, 20)
+        title = u'%s - %s' % (ctx.website.name, category.name)
+        link = 'http://%s/category/%s' % (domain, category.id)
+        path = '/feed/category/%s' % category.id
+    else:
+        articles, paging = _get_articles(1, 20)
+        title = ctx.website.name
+        link = 'http://%s/' % domain
+        path = '/feed'
+    htmls = html.to_htmls(articles, 'articles')
+    items = [Dict(title=a.name, link='http://%s/article/%s' % (domain, a.id), author=a.user_name, \
+                  published=a.creation_time, updated=a.modified_time, html=h) for a, h in zip(articles, htmls)]
+    if fmt=='atom':
+        updated = max([a.modified_time for a in articles]) if articles else time.time()
+        return feed.atom(title, link, 'http://%s%s/atom' % (domain, path), ss['description'], items, updated)
+    build_time = articles and articles[0].creation_time or time.time()
+    return feed.rss(title, link, ss['description'], items, build_time)
 
 if __name__=='__main__':
     import doctest
@@ -8,10 +8,10 @@ from datetime import datetime, timedelta
 
 from transwarp.web import ctx, get, post, route, seeother, notfound, UTC, UTC_0, Template, Dict
 from transwarp.mail import send_mail
-from transwarp import db, task
+from transwarp import db, cache, task
 
 from apiexporter import *
-import setting, loader, async, plugin
+import setting, loader, async, plugin, html, pagecache, counter, util, auth, rowcache
 
 from plugin import store, theme
 from install import create_website, create_user
@@ -22,6 +22,34 @@ from apps import menu
 # Overview
 ################################################################################
 
+# set when no hourly traffic counter written before daily rollups is left:
+_LEGACY_TRAFFIC_DONE_KEY = '__LEGACY_TRAFFIC_DONE__@%s'
+
+def _add_hourly_traffic(wid, d_start, days):
+    '''
+    Sum up hourly traffic counters written before daily rollups by one cache
+    call. Only leading days without daily counter can be before rollups, and
+    once none of them has hourly counters, hourly counters are never read
+    again, so the fallback ends within one rollup window.
+    '''
+    k = 0
+    while k < len(days) and not days[k]:
+        k = k + 1
+    if k==0 or cache.client.get(_LEGACY_TRAFFIC_DONE_KEY % wid):
+        return days
+    keys = []
+    for n in range(k):
+        h = int(counter.rollup_time(counter.ROLLUP_DAY, d_start + n)) // 3600
+        keys.extend(['counter_%s_%d' % (wid, h + i) for i in range(24)])
+    results = [int(r or 0) for r in cache.client.gets(*keys)]
+    if not any(results):
+        cache.client.set(_LEGACY_TRAFFIC_DONE_KEY % wid, True)
+        return days
+    days = list(days)
+    for n in range(k):
+        days[n] = sum(results[n * 24:n * 24 + 24])
+    return days
+
 @menu(ROLE_ADMINISTRATORS, 'Dashboard', 'Overview', group_order=0)
 def overview():
     # find timestamp at today's 00:00
@@ -31,12 +59,10 @@ def overview():
     site_dateformat = ss[setting.WEBSITE_DATE_FORMAT]
     start_date = now - timedelta(days=15)
     end_date = now - timedelta(days=1)
-    h_end = int(time.mktime(now.replace(hour=0).timetuple())) // 3600
-    wid = ctx.website.id
-    keys = map(lambda x: 'counter_%s_%d' % (wid, x), range(h_end - 336, h_end))
-    results = map(lambda x: 0 if x is None else int(x), cache.client.gets(*keys))
-    rs = [(24 * n, 24 * n + 24) for n in range(14)]
-    days = [sum(results[l:h]) for l, h in rs]
+    d_end = counter.rollup_index(counter.ROLLUP_DAY, time.time())
+    days = counter.get_rollups('traffic_%s' % ctx.website.id, counter.ROLLUP_DAY, d_end - 14, d_end)
+    if not days[0]:
+        days = _add_hourly_traffic(ctx.website.id, d_end - 14, days)
     d = dict(
         articles = db.select_int('select count(id) from articles'),
         pages = db.select_int('select count(id) from pages'),
@@ -48,6 +74,13 @@ def overview():
     )
     return Template('templates/overview.html', **d)
 
+@api(role=ROLE_SUPER_ADMINS)
+@get('/api/stats/caches')
+def api_get_cache_stats():
+    ' get hit, miss and eviction counters of caches in current process. '
+    stats = getattr(cache.client, 'stats', None)
+    return dict(html=html.get_cache_stats(), rows=rowcache.get_cache_stats(), values=stats() if stats else None)
+
 ################################################################################
 # Navs
 ################################################################################
@@ -92,6 +125,7 @@ def api_update_navigation():
     nav = _get_navigation(i.id)
     if nav.name != name:
         db.update('update navigations set name=? where id=?', name, i.id)
+        setting.invalidate_snapshot()
     return True
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -102,6 +136,7 @@ def api_delete_navigation():
         raise APIValueError('id', 'id cannot be empty')
     nav = _get_navigation(i.id)
     db.update('delete from navigations where id=?', i.id)
+    setting.invalidate_snapshot()
     return True
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -134,6 +169,7 @@ def api_create_navigation():
                 modified_time = current,
                 version = 0)
             db.insert('navigations', **navigation)
+            setting.invalidate_snapshot()
             return True
     raise ValueError('id', 'invalid id')
 
@@ -146,16 +182,12 @@ def api_sort_navigations():
     if l != len(ids):
         raise APIValueError('id', 'bad id list.')
     sets = set([n.id for n in navs])
-    odict = dict()
-    n = 0
     for o in ids:
         if not o in sets:
             raise APIValueError('id', 'some id was invalid.')
-        odict[o] = n
-        n = n + 1
     with db.transaction():
-        for n in navs:
-            db.update('update navigations set display_order=? where id=?', odict.get(n.id, l), n.id)
+        util.reorder('navigations', navs, ids)
+    setting.invalidate_snapshot()
     return True
 
 @menu(ROLE_ADMINISTRATORS, 'Settings', 'Navigations', name_order=2)
@@ -229,6 +261,7 @@ def api_delete_user():
         if not _can_delete_user(u):
             raise APIPermissionError('Cannot delete locked user.')
         db.update('delete from users where id=?', i.id)
+        auth.invalidate_user(u)
         return True
     raise APIValueError('id', 'User not found.')
 
@@ -258,6 +291,7 @@ def api_update_user():
         kw['passwd'] = passwd
     if kw:
         db.update_kw('users', 'id=?', i.id, **kw)
+        auth.invalidate_user(u)
     return True
 
 def _get_role_list(starts_from=ROLE_ADMINISTRATORS):
@@ -515,6 +549,7 @@ def domain():
                 error = e.message
             if cname=='host.itranswarp.com':
                 db.update('update websites set domain=? where id=?', domain, ctx.website.id)
+                loader.invalidate_sites()
                 raise seeother('http://%s/auth/signin' % domain)
     return Template('templates/domain.html', error=error, domain=ctx.website.domain)
 
@@ -547,6 +582,8 @@ def api_update_website_settings():
     # update website name for table 'website':
     setting.set_website_settings(**i)
     db.update('update websites set name=? where id=?', name, ctx.website.id)
+    loader.invalidate_sites()
+    pagecache.bump()
     return True
 
 @menu(ROLE_ADMINISTRATORS, 'Settings', 'General', group_order=500, name_order=1)
@@ -632,22 +669,19 @@ def tasks():
 
 @menu(ROLE_SUPER_ADMINS, 'Administration', 'Websites', name_order=0)
 def websites():
-    i = ctx.request.input(action='', page='1')
+    i = ctx.request.input(action='', page='1', after='', before='')
     if i.action=='disable' or i.action=='enable':
         website = db.select_one('select * from websites where id=?', i.id)
         db.update('update websites set disabled=? where id=?', i.action=='disable', i.id)
+        loader.invalidate_sites()
+        pagecache.bump(i.id)
         raise seeother('websites')
-    page = int(i.page)
-    websites = db.select('select * from websites order by id desc limit ?,?', 50*(page-1), 51)
-    next = len(websites)==51
-    if next:
-        websites = websites[:-1]
-    previous = page > 1
-    return Template('templates/websites.html', websites=websites, page=page, previous=previous, next=next)
+    websites, paging = util.select_page('websites', '', [], 50, int(i.page), i.after, i.before)
+    return Template('templates/websites.html', websites=websites, **paging)
 
 @menu(ROLE_SUPER_ADMINS, 'Administration', 'Registrations', name_order=4)
 def registrations():
-    i = ctx.request.input(action='', page='1')
+    i = ctx.request.input(action='', page='1', after='', before='')
     if i.action=='decline':
         registration = db.select_one('select * from registrations where id=?', i.id)
         db.update('delete from registrations where id=?', i.id)
@@ -665,13 +699,8 @@ def registrations():
         body = '<html><body><p>Hi,</p><p>Thank you for register your website on iTranswarp!</p><p>Please click the link below to activate your website:</p><p><a href="http://www.itranswarp.com/register/activate?id=%s&code=%s">Activate</a></p></body></html>' % (registration.id, verification)
         async.send_mail(registration.email, subject, body)
         raise seeother('registrations')
-    page = int(i.page)
-    previous = page > 1
-    registrations = db.select('select * from registrations order by id limit ?,?', 50 * (page - 1), 51)
-    next = len(registrations)==51
-    if next:
-        registrations = registrations[:-1]
-    return Template('templates/registrations.html', registrations=registrations, page=page, previous=previous, next=next)
+    registrations, paging = util.select_page('registrations', '', [], 50, int(i.page), i.after, i.before, desc=False)
+    return Template('templates/registrations.html', registrations=registrations, **paging)
 
 @get('/register/activate')
 def activate_registration():
@@ -683,6 +712,7 @@ def activate_registration():
         name = registration.name
         domain = registration.domain
         passwd = create_website(email, name, domain)
+        loader.invalidate_sites()
         subject = u'You Website %s is Ready' % name
         body = '<html><body><p>Hi,</p><p>Your website is ready for use!</p>' \
              + '<p>You can sign in from <a href="http://%s/auth/signin">http://%s/auth/signin</a></p>' % (domain, domain) \
@@ -747,8 +777,8 @@ def api_url_resource():
     i = ctx.request.input(id='')
     if not i.id:
         raise notfound()
-    r = db.select_one('select website_id, url, deleted from resources where id=?', i.id)
-    if r.deleted or r.website_id != ctx.website.id:
+    r = rowcache.get('resources', i.id)
+    if r is None or r.deleted or r.website_id != ctx.website.id:
         raise notfound()
     ctx.response.header('Cache-Control: max-age=36000')
     raise seeother(r.url)
@@ -3,16 +3,17 @@
 
 __author__ = 'Michael Liao'
 
-import re, time, uuid, logging
+import re, cgi, json, time, uuid, logging
 from datetime import datetime
 
 from transwarp.web import ctx, get, post, route, seeother, notfound, Template, Dict
-from transwarp import db
+from transwarp import db, cache
 
 from apiexporter import *
-import setting, loader, plugin, html, counter
+import setting, loader, plugin, html, counter, pagecache, generation, lru, util, rowcache
 
 from plugin.theme import theme
+from conditional import conditional
 
 from apps import menu
 
@@ -26,7 +27,9 @@ def _get_wikis():
 
 def _get_wiki(wid):
     ' get wiki by id. raise APIPermissionError if wiki is not belong to current website. '
-    wiki = db.select_one('select * from wikis where id=?', wid)
+    wiki = rowcache.get('wikis', wid)
+    if wiki is None:
+        raise notfound()
     if wiki.website_id != ctx.website.id:
         raise APIPermissionError('cannot get wiki that does not belong to current website.')
     return wiki
@@ -68,6 +71,9 @@ def api_update_wiki():
         kw['version'] = wiki.version + 1
         kw['modified_time'] = time.time()
         db.update_kw('wikis', 'id=?', i.id, **kw)
+        rowcache.delete('wikis', i.id)
+        html.save_html('wikis', i.id, kw['version'], kw.get('content', wiki.content))
+        pagecache.bump()
     return True
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -88,10 +94,13 @@ def api_create_wiki():
         name=name, \
         description=i.description.strip(), \
         content=content, \
+        read_count=0, \
         creation_time=current, \
         modified_time=current, \
         version=0)
     db.insert('wikis', **wiki)
+    html.save_html('wikis', wiki.id, wiki.version, content)
+    pagecache.bump()
     return wiki
 
 @api(role=ROLE_ADMINISTRATORS)
@@ -106,6 +115,10 @@ def api_delete_wiki():
     if count > 0:
         raise APIValueError('id', 'cannot delete non-empty wiki.')
     db.update('delete from wikis where id=?', wiki.id)
+    rowcache.delete('wikis', wiki.id)
+    db.update('delete from wiki_navs where id=?', wiki.id)
+    html.delete_html(wiki.id)
+    pagecache.bump()
     return True
 
 @menu(ROLE_EDITORS, 'Wiki', 'All Wikis', group_order=30, name_order=0)
@@ -129,43 +142,167 @@ def add_wiki():
     ' show New Wiki menu. '
     return Template('templates/wikiform.html', form_title='Add Wiki', form_action='/api/wikis/create')
 
-def _tree_iter(nodes, root):
-    rid = root.id
-    root.children = []
-    for nid in nodes.keys():
-        node = nodes[nid]
-        if node.parent_id==rid:
-            root.children.append(node)
-            nodes.pop(nid)
-    if root.children:
-        root.children.sort(cmp=lambda n1, n2: -1 if n1.display_order < n2.display_order else 1)
-        for ch in root.children:
-            _tree_iter(nodes, ch)
+# trees of wiki pages are cached by generation of wiki:
+_TREE_KEY = '__WIKITREE__@%s:%d'
+_TREE_TIMEOUT = 86400
+
+_local_trees = lru.LRUCache(max_items=100)
+
+def _tree_generation_name(wiki_id):
+    return 'wiki:%s' % wiki_id
+
+def _tree_changed(wiki_id):
+    ' called after wiki pages were created, moved, renamed or deleted. '
+    _rebuild_nav(wiki_id)
+    generation.bump(_tree_generation_name(wiki_id))
+    pagecache.bump()
+
+def _build_tree(pages):
+    '''
+    Build tree of pages by one pass of parent -> children index. Children of
+    each page are set as 'children' ordered by display_order. Pages whose
+    parent does not exist are dropped.
+
+    Returns:
+        list of root pages.
+
+    >>> ps = [Dict(id='a', parent_id='', display_order=1), Dict(id='b', parent_id='', display_order=0), Dict(id='c', parent_id='a', display_order=0), Dict(id='d', parent_id='x', display_order=0)]
+    >>> roots = _build_tree(ps)
+    >>> [n.id for n in roots]
+    ['b', 'a']
+    >>> [n.id for n in roots[1].children]
+    ['c']
+    '''
+    index = dict()
+    for p in pages:
+        index.setdefault(p.parent_id, []).append(p)
+    for L in index.itervalues():
+        L.sort(key=lambda p: (p.display_order, p.id))
+    for p in pages:
+        p.children = index.get(p.id, [])
+    return index.get('', [])
+
+def _iter_tree(nodes):
+    ' iterate nodes and all descendants by depth-first order. '
+    for n in nodes:
+        yield n
+        for ch in _iter_tree(n.children):
+            yield ch
 
 def _get_wikipage(wp_id, wiki_id=None):
     '''
     get a wiki page by id. raise APIPermissionError if wiki is not belong to current website.
     if the wiki_id is not None, it also check if the page belongs to wiki.
     '''
-    wp = db.select_one('select * from wiki_pages where id=?', wp_id)
+    wp = rowcache.get('wiki_pages', wp_id)
+    if wp is None:
+        raise notfound()
     if wp.website_id != ctx.website.id:
         raise APIPermissionError('cannot get wiki page that is not belong to current website.')
     if wiki_id and wp.wiki_id != wiki_id:
         raise APIValueError('wiki_id', 'bad wiki id.')
     return wp
 
-def _get_wikipages(wiki, returnDict=False):
+def _load_wikipages(wiki_id):
+    ' load all wiki pages without content. '
+    return db.select('select id, website_id, wiki_id, parent_id, display_order, name, version from wiki_pages where wiki_id=?', wiki_id)
+
+@cached(key='wiki_tree', timeout=_TREE_TIMEOUT, single_flight=True)
+def _load_tree(wiki_id, gen):
+    ' load tree of wiki pages by one caller across processes after generation of wiki was bumped. '
+    return _build_tree(_load_wikipages(wiki_id))
+
+def _get_wikipages(wiki):
     '''
     Get all wiki pages and return as tree. Each wiki page contains only id, website_id, wiki_id, parent_id, display_order, name and version.
-    The return value is virtual root node.
+    The return value is list of root pages. The tree is cached until the generation of wiki is bumped, and must not be modified.
     '''
-    pages = db.select('select id, website_id, wiki_id, parent_id, display_order, name, version from wiki_pages where wiki_id=?', wiki.id)
-    pdict = dict(((p.id, p) for p in pages))
-    if returnDict:
-        return pdict
-    proot = Dict(id='')
-    _tree_iter(pdict, proot)
-    return proot.children
+    gen = generation.get(_tree_generation_name(wiki.id))
+    key = _TREE_KEY % (wiki.id, gen)
+    tree = _local_trees.get(key)
+    if tree is None:
+        tree = _load_tree(wiki.id, str(gen))
+        _local_trees.set(key, tree)
+    return tree
+
+################################################################################
+# Navigation of wiki that is stored in table wiki_navs and rebuilt after pages
+# were changed, so viewing a page does not need to load all pages.
+################################################################################
+
+_NAV_KEY = '__WIKINAV__@%s:%d'
+
+_local_navs = lru.LRUCache(max_items=100)
+
+def _render_sidebar(wiki_id, nodes):
+    L = [u'<ul>']
+    for n in nodes:
+        L.append(u'<li id="%s"><a href="/wiki/%s/%s">%s</a>' % (n.id, wiki_id, n.id, cgi.escape(n.name, True)))
+        if n.children:
+            L.append(_render_sidebar(wiki_id, n.children))
+        L.append(u'</li>')
+    L.append(u'</ul>')
+    return u''.join(L)
+
+def _make_nav(wiki_id, pages):
+    '''
+    Make navigation of wiki as dict with sidebar html, page ids in depth-first
+    order, and pages as dict of id -> dict(name, breadcrumbs, previous, next).
+
+    >>> ps = [Dict(id='a', parent_id='', display_order=0, name=u'A'), Dict(id='b', parent_id='a', display_order=0, name=u'B&'), Dict(id='c', parent_id='', display_order=1, name=u'C')]
+    >>> nav = _make_nav('w', ps)
+    >>> nav['order']
+    ['a', 'b', 'c']
+    >>> nav['pages']['b']['breadcrumbs'], nav['pages']['b']['previous'], nav['pages']['b']['next']
+    (['a'], 'a', 'c')
+    >>> nav['sidebar']
+    u'<ul><li id="a"><a href="/wiki/w/a">A</a><ul><li id="b"><a href="/wiki/w/b">B&amp;</a></li></ul></li><li id="c"><a href="/wiki/w/c">C</a></li></ul>'
+    '''
+    roots = _build_tree(pages)
+    order = list(_iter_tree(roots))
+    navs = dict()
+    def _walk(nodes, crumbs):
+        for n in nodes:
+            navs[n.id] = dict(name=n.name, breadcrumbs=crumbs)
+            _walk(n.children, crumbs + [n.id])
+    _walk(roots, [])
+    for i, n in enumerate(order):
+        navs[n.id]['previous'] = order[i - 1].id if i > 0 else None
+        navs[n.id]['next'] = order[i + 1].id if i + 1 < len(order) else None
+    return dict(sidebar=_render_sidebar(wiki_id, roots), order=[n.id for n in order], pages=navs)
+
+def _rebuild_nav(wiki_id):
+    ' rebuild and store navigation of wiki. '
+    nav = _make_nav(wiki_id, _load_wikipages(wiki_id))
+    util.upsert('wiki_navs', id=wiki_id, website_id=ctx.website.id, content=json.dumps(nav), creation_time=time.time())
+    return nav
+
+@cached(key='wiki_nav', timeout=_TREE_TIMEOUT, single_flight=True)
+def _load_nav(wiki_id, gen):
+    ' load navigation of wiki by one caller across processes, so it is rebuilt only once. '
+    L = db.select('select content from wiki_navs where id=?', wiki_id)
+    return json.loads(L[0].content) if L else _rebuild_nav(wiki_id)
+
+def _get_nav(wiki_id):
+    ' get navigation of wiki, cached until the generation of wiki is bumped. '
+    gen = generation.get(_tree_generation_name(wiki_id))
+    key = _NAV_KEY % (wiki_id, gen)
+    nav = _local_navs.get(key)
+    if nav is None:
+        nav = _load_nav(wiki_id, str(gen))
+        _local_navs.set(key, nav)
+    return nav
+
+def _nav_model(wiki_id, nav, page_id=None):
+    ' make model of navigation for page, or wiki if page_id is None. '
+    pages = nav['pages']
+    def _link(pid):
+        return Dict(id=pid, name=pages[pid]['name']) if pid else None
+    if page_id is None or not page_id in pages:
+        first = nav['order'][0] if nav['order'] else None
+        return dict(wiki_sidebar=nav['sidebar'], breadcrumbs=[], previous=None, next=_link(first) if page_id is None else None)
+    p = pages[page_id]
+    return dict(wiki_sidebar=nav['sidebar'], breadcrumbs=[_link(pid) for pid in p['breadcrumbs']], previous=_link(p['previous']), next=_link(p['next']))
 
 def _create_wiki_page(wiki_id, parent_id, display_order, name, content):
     current = time.time()
@@ -176,10 +313,13 @@ def _create_wiki_page(wiki_id, parent_id, display_order, name, content):
         display_order=display_order, \
         name=name, \
         content=content, \
+        read_count=0, \
         creation_time=current, \
         modified_time=current, \
         version=0)
     db.insert('wiki_pages', **p)
+    html.save_html('wiki_pages', p['id'], p['version'], content)
+    _tree_changed(wiki_id)
     return p
 
 @api(role=ROLE_GUESTS)
@@ -194,24 +334,39 @@ def api_list_wikipages():
     wiki = _get_wiki(i.id)
     return _get_wikipages(wiki)
 
-@theme('wiki.html')
+def _wiki_validator(wiki_id, page_id=None):
+    w = rowcache.get('wikis', wiki_id)
+    if w is None or w.website_id != ctx.website.id:
+        return None
+    if page_id is None:
+        return (wiki_id, w.version), w.modified_time
+    p = rowcache.get('wiki_pages', page_id)
+    if p is None or p.wiki_id != wiki_id:
+        return None
+    return (wiki_id, w.version, page_id, p.version), max(w.modified_time, p.modified_time)
+
+@theme('wiki.html', page_cache=True)
+@conditional(_wiki_validator)
 @route('/wiki/<wiki_id>')
 def wiki_by_id(wiki_id):
     wiki = _get_wiki(wiki_id)
-    pages = _get_wikipages(wiki)
     return dict(__navigation__=('/wiki/%s' % wiki_id,), \
-        wiki=wiki, pages=pages, wiki_name=wiki.name, wiki_content=html.to_html(wiki), \
-        read_count=counter.inc(wiki.id))
+        __counters__=((wiki.id, 'wikis'),), \
+        wiki=wiki, wiki_name=wiki.name, wiki_content=html.to_html(wiki, 'wikis'), \
+        read_count=wiki.read_count + counter.inc(wiki.id, 'wikis'), \
+        **_nav_model(wiki.id, _get_nav(wiki.id)))
 
-@theme('wiki.html')
+@theme('wiki.html', page_cache=True)
+@conditional(_wiki_validator)
 @route('/wiki/<wiki_id>/<page_id>')
 def wiki_page_by_id(wiki_id, page_id):
     wiki = _get_wiki(wiki_id)
     page = _get_wikipage(page_id, wiki_id)
-    pages = _get_wikipages(wiki)
     return dict(__navigation__=('/wiki/%s' % wiki_id,), \
-        wiki=wiki, pages=pages, page=page, wiki_name=page.name, wiki_content=html.to_html(page), \
-        read_count=counter.inc(page.id))
+        __counters__=((page.id, 'wiki_pages'),), \
+        wiki=wiki, page=page, wiki_name=page.name, wiki_content=html.to_html(page, 'wiki_pages'), \
+        read_count=page.read_count + counter.inc(page.id, 'wiki_pages'), \
+        **_nav_model(wiki.id, _get_nav(wiki.id), page.id))
 
 @api(role=ROLE_EDITORS)
 @post('/api/wikipages/create')
@@ -251,6 +406,12 @@ def api_update_wikipage():
         kw['modified_time'] = time.time()
         kw['version'] = page.version + 1
         db.update_kw('wiki_pages', 'id=?', i.id, **kw)
+        rowcache.delete('wiki_pages', i.id)
+        html.save_html('wiki_pages', i.id, kw['version'], kw.get('content', page.content))
+        if 'name' in kw:
+            _tree_changed(page.wiki_id)
+        else:
+            pagecache.bump()
     return True
 
 @api(role=ROLE_EDITORS)
@@ -274,26 +435,25 @@ def api_move_wikipages():
     if i.move_to:
         parent_page = _get_wikipage(i.move_to, wiki.id)
     # check to prevent recursive:
-    pages = _get_wikipages(wiki, returnDict=True)
+    pages = _load_wikipages(wiki.id)
+    roots = _build_tree(pages)
+    pdict = dict(((p.id, p) for p in pages))
     if parent_page:
-        p = parent_page
-        while p.parent_id != '':
-            if p.parent_id==moving_page.id:
-                raise APIValueError('move_to', 'Will cause recursive.')
-            p = pages[p.parent_id]
+        if parent_page.id==moving_page.id or parent_page.id in set((p.id for p in _iter_tree(pdict[moving_page.id].children))):
+            raise APIValueError('move_to', 'Will cause recursive.')
     # get current children:
     parent_id = parent_page.id if parent_page else ''
-    L = [p for p in pages.itervalues() if p.parent_id==parent_id and p.id!=moving_page.id]
-    L.sort(cmp=lambda p1, p2: -1 if p1.display_order<p2.display_order else 1)
+    siblings = pdict[parent_id].children if parent_id else roots
+    L = [p for p in siblings if p.id!=moving_page.id]
     # insert at index N:
     L.insert(index, moving_page)
     # update display order:
     with db.transaction():
-        n = 0
-        for p in L:
-            db.update('update wiki_pages set display_order=? where id=?', n, p.id)
-            n = n + 1
-        db.update('update wiki_pages set parent_id=? where id=?', parent_id, moving_page.id)
+        util.reorder('wiki_pages', pages, [p.id for p in L])
+        if moving_page.parent_id != parent_id:
+            db.update('update wiki_pages set parent_id=? where id=?', parent_id, moving_page.id)
+    rowcache.delete('wiki_pages', *[p.id for p in L])
+    _tree_changed(wiki.id)
     return True
 
 @api(role=ROLE_EDITORS)
@@ -306,6 +466,9 @@ def api_delete_wikipage():
     if db.select_int('select count(id) from wiki_pages where wiki_id=? and parent_id=?', page.wiki_id, page.id) > 0:
         raise APIPermissionError('cannot delete non empty page.')
     db.update('delete from wiki_pages where id=?', page.id)
+    rowcache.delete('wiki_pages', page.id)
+    html.delete_html(page.id)
+    _tree_changed(page.wiki_id)
     return True
 
 ################################################################################
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Build fingerprinted assets of themes:
+
+python assets.py [theme ...]
+
+A theme declares bundles in its __init__.py as logical name -> source files
+under its static directory:
+
+    bundles = {
+        'css/site.css': ['css/reset.css', 'css/custom.css'],
+        'js/site.js': ['js/jquery-1.9.0.min.js', 'js/custom.js'],
+    }
+
+Each bundle is concatenated, minified and written to the build directory
+static/build/<theme> (ignored by git) with the content hash in file name, e.g.
+static/build/default/css/site.3f2a9c1d0b.css. Relative url() in css is
+rewritten to the url of theme static directory. Other css and js files are
+fingerprinted as they are. The map of logical name -> fingerprinted file is
+written to static/build/<theme>/assets.json.
+
+Templates get urls of a logical name by __get_assets__('css/site.css'). If
+the theme is not built or debug is True (e.g. in development), urls of source
+files are returned instead.
+'''
+
+import os, re, sys, imp, json, shutil, hashlib, logging, posixpath
+
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+THEME_DIR = os.path.join(_ROOT_DIR, 'plugin', 'theme')
+BUILD_DIR = os.path.join(_ROOT_DIR, 'static', 'build')
+
+# set to True to use source files instead of built files:
+debug = False
+
+_MANIFEST = 'assets.json'
+_HASH_LENGTH = 10
+
+# quoted strings and comments of css:
+_RE_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/)', re.DOTALL)
+_RE_CSS_SPACES = re.compile(r'\s+')
+_RE_CSS_PUNCTUATION = re.compile(r'\s*([{};,])\s*')
+_RE_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+def minify_css(s):
+    '''
+    Remove comments and needless whitespaces of css. Quoted strings are kept
+    as they are.
+
+    >>> minify_css('/* header */\\nh1 ,h2 {\\n    color: red;\\n    margin: 0 auto;\\n}\\n')
+    'h1,h2{color: red;margin: 0 auto}'
+    >>> minify_css('p:before { content: "a ,  b;  /* c */" ; }')
+    'p:before{content: "a ,  b;  /* c */"}'
+    '''
+    L = []
+    for n, part in enumerate(_RE_CSS_TOKENS.split(s)):
+        if n % 2 == 0:
+            part = _RE_CSS_SPACES.sub(' ', part)
+            part = _RE_CSS_PUNCTUATION.sub(r'\1', part)
+        elif part.startswith('/*'):
+            continue
+        L.append(part)
+    return ''.join(L).replace(';}', '}').strip()
+
+def rewrite_css_urls(s, name, prefix):
+    '''
+    Rewrite relative url() of css file name to absolute url with prefix.
+
+    >>> rewrite_css_urls('a{background:url("../img/a.png")} b{background:url(data:x)}', 'css/site.css', '/theme/')
+    'a{background:url("/theme/img/a.png")} b{background:url(data:x)}'
+    '''
+    def _rewrite(m):
+        url = m.group(2).strip()
+        if url.startswith('/') or url.startswith('#') or ':' in url:
+            return m.group(0)
+        url = prefix + posixpath.normpath(posixpath.join(posixpath.dirname(name), url))
+        return 'url(%s%s%s)' % (m.group(1), url, m.group(1))
+    return _RE_CSS_URL.sub(_rewrite, s)
+
+def minify_js(s):
+    '''
+    Strip blank lines and trailing spaces of js. Identifiers and comments are
+    kept since js cannot be minified safely without a parser.
+
+    >>> minify_js('var a = 1;  \\n\\n\\nvar b = 2;\\n')
+    'var a = 1;\\nvar b = 2;'
+    '''
+    return '\n'.join([line.rstrip() for line in s.splitlines() if line.strip()])
+
+def fingerprint(name, content):
+    '''
+    Make file name with hash of content.
+
+    >>> fingerprint('css/site.css', 'body{}')
+    'css/site.aa676972bb.css'
+    '''
+    base, ext = os.path.splitext(name)
+    return '%s.%s%s' % (base, hashlib.md5(content).hexdigest()[:_HASH_LENGTH], ext)
+
+def get_bundles(theme):
+    ' get bundles declared by __init__.py of theme. '
+    m = imp.load_source('_theme_assets_%s' % theme, os.path.join(THEME_DIR, theme, '__init__.py'))
+    return getattr(m, 'bundles', dict())
+
+def _read(static_dir, name):
+    with open(os.path.join(static_dir, name), 'rb') as f:
+        return f.read()
+
+def _static_prefix(theme):
+    return '/plugin/theme/%s/static/' % theme
+
+def _minify(theme, name, content):
+    if name.endswith('.css'):
+        return minify_css(rewrite_css_urls(content, name, _static_prefix(theme)))
+    if name.endswith('.js') and not name.endswith('.min.js'):
+        return minify_js(content)
+    return content
+
+def _list_sources(static_dir):
+    L = []
+    for root, dirs, files in os.walk(static_dir):
+        for f in files:
+            name = os.path.relpath(os.path.join(root, f), static_dir).replace(os.sep, '/')
+            if (name.endswith('.css') or name.endswith('.js')) and os.path.isfile(os.path.join(root, f)):
+                L.append(name)
+    return sorted(L)
+
+def _write(build_dir, name, content):
+    fpath = os.path.join(build_dir, *name.split('/'))
+    d = os.path.dirname(fpath)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    with open(fpath, 'wb') as f:
+        f.write(content)
+
+def _load_manifest(build_dir):
+    mpath = os.path.join(build_dir, _MANIFEST)
+    if not os.path.isfile(mpath):
+        return None
+    with open(mpath, 'rb') as f:
+        return json.load(f)
+
+def build(theme):
+    '''
+    Build assets of theme into build directory and write manifest.
+
+    Returns:
+        manifest as dict of logical name -> fingerprinted file.
+    '''
+    static_dir = os.path.join(THEME_DIR, theme, 'static')
+    build_dir = os.path.join(BUILD_DIR, theme)
+    # remove files of last build:
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    manifest = dict()
+    bundles = get_bundles(theme)
+    for bundle, sources in bundles.iteritems():
+        # a script without trailing semicolon must not run into the next one:
+        sep = '\n;' if bundle.endswith('.js') else '\n'
+        L = []
+        for src in sources:
+            if os.path.isfile(os.path.join(static_dir, src)):
+                L.append(_minify(theme, src, _read(static_dir, src)))
+            else:
+                logging.warning('skip missing file %s of bundle %s in theme %s.' % (src, bundle, theme))
+        content = sep.join(L)
+        manifest[bundle] = fingerprint(bundle, content)
+        _write(build_dir, manifest[bundle], content)
+    for name in _list_sources(static_dir):
+        if name in manifest:
+            continue
+        content = _minify(theme, name, _read(static_dir, name))
+        manifest[name] = fingerprint(name, content)
+        _write(build_dir, manifest[name], content)
+    _write(build_dir, _MANIFEST, json.dumps(manifest, indent=2, sort_keys=True))
+    logging.info('built %d assets of theme %s.' % (len(manifest), theme))
+    return manifest
+
+# theme -> (manifest, bundles):
+_themes = dict()
+
+def get_urls(theme, name):
+    '''
+    Get urls of logical asset name of theme. A built theme returns the one
+    fingerprinted url, otherwise urls of source files are returned.
+    '''
+    t = _themes.get(theme)
+    if t is None:
+        manifest = None if debug else _load_manifest(os.path.join(BUILD_DIR, theme))
+        t = (manifest, None if manifest else get_bundles(theme))
+        _themes[theme] = t
+    manifest, bundles = t
+    if manifest and name in manifest:
+        return ['/static/build/%s/%s' % (theme, manifest[name])]
+    prefix = _static_prefix(theme)
+    if bundles and name in bundles:
+        return [prefix + src for src in bundles[name]]
+    return [prefix + name]
+
+if __name__=='__main__':
+    logging.basicConfig(level=logging.INFO)
+    themes = sys.argv[1:] or sorted([d for d in os.listdir(THEME_DIR) if os.path.isdir(os.path.join(THEME_DIR, d))])
+    for theme in themes:
+        build(theme)
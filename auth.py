@@ -13,14 +13,56 @@ except ImportError:
     from StringIO import StringIO
 
 from transwarp.web import ctx, view, get, post, route, Dict, Template, seeother, notfound, badrequest
-from transwarp import db
+from transwarp import db, cache
 
 from apiexporter import *
+import lru
 
 _SESSION_COOKIE_NAME = '_auth_session_cookie_'
 _SESSION_COOKIE_SALT = '_Auth-SalT_'
 _SESSION_COOKIE_EXPIRES = 604800.0
 
+# users are cached in cache, and in process for a few seconds:
+_USER_KEY = '__USER__@%s'
+_USER_TIMEOUT = 600
+_LOCAL_USER_TIMEOUT = 10
+
+_local_users = lru.LRUCache(max_items=10000, timeout=_LOCAL_USER_TIMEOUT)
+
+# verified basic auth credentials as email -> Dict(digest, uid), and failed
+# attempts as email -> failures, which expire _BASIC_AUTH_TIMEOUT seconds after
+# the first failure since incr() never extends the expiry:
+_BASIC_AUTH_TIMEOUT = 300
+_BASIC_AUTH_MAX_FAILURES = 10
+
+_basic_auths = lru.LRUCache(max_items=10000, timeout=_BASIC_AUTH_TIMEOUT)
+_basic_auth_failures = lru.LRUCache(max_items=10000, timeout=_BASIC_AUTH_TIMEOUT)
+
+def _get_cached_user(uid):
+    '''
+    Get user by id from cache, or from db if not cached. The returned user 
+    contains passwd and must not be modified.
+    '''
+    user = _local_users.get(uid)
+    if user is None:
+        user = cache.client.get(_USER_KEY % uid)
+        if user is None:
+            user = db.select_one('select * from users where id=?', uid)
+            if user is None:
+                raise ValueError('user not found: %s' % uid)
+            cache.client.set(_USER_KEY % uid, user, _USER_TIMEOUT)
+        _local_users.set(uid, user)
+    return user
+
+def invalidate_user(user):
+    '''
+    Invalidate cached user after the user was updated or deleted. Other 
+    processes may see the cached user for at most _LOCAL_USER_TIMEOUT seconds.
+    '''
+    _local_users.delete(user.id)
+    _basic_auths.delete(user.email)
+    cache.client.delete(_USER_KEY % user.id)
+
 @get('/auth/signin')
 @view('templates/auth/signin.html')
 def signin():
@@ -70,16 +112,40 @@ def signout():
     raise seeother(redirect)
 
 def http_basic_auth(auth):
+    '''
+    Verify value of header 'Authorization: Basic xxx' and return user, or None if
+    failed. Verified credentials are cached, and an email is rejected without
+    checking password after _BASIC_AUTH_MAX_FAILURES failed attempts until 
+    _BASIC_AUTH_TIMEOUT seconds after the first failed attempt.
+    '''
     try:
         s = base64.b64decode(auth)
-        logging.warn(s)
         u, p = s.split(':', 1)
+        digest = hashlib.md5(p).hexdigest()
+        if _basic_auth_failures.get(u, 0) >= _BASIC_AUTH_MAX_FAILURES:
+            logging.warning('Basic auth rejected for too many failures: %s' % u)
+            return None
+        entry = _basic_auths.get(u)
+        if entry is not None:
+            if entry.digest==digest:
+                cached = _get_cached_user(entry.uid)
+                # password may be changed in other process:
+                if cached.passwd==digest:
+                    user = Dict(**cached)
+                    user.passwd = '******'
+                    return user
         user = db.select_one('select * from users where email=?', u)
-        if user.passwd==hashlib.md5(p).hexdigest():
+        if user and user.passwd==digest:
             logging.info('Basic auth ok: %s' % u)
-            # clear passwd in memory:
+            _basic_auths.set(u, Dict(digest=digest, uid=user.id))
+            _basic_auth_failures.delete(u)
+            _local_users.set(user.id, user)
+            # copy user and clear password:
+            user = Dict(**user)
             user.passwd = '******'
             return user
+        _basic_auths.delete(u)
+        _basic_auth_failures.incr(u)
         return None
     except BaseException, e:
         logging.exception('auth failed.')
@@ -124,12 +190,13 @@ def extract_session_cookie():
         uid, exp, md5 = ss
         if float(exp) < time.time():
             raise ValueError('expired cookie: %s' % s)
-        user = db.select_one('select * from users where id=?', uid)
-        expected_pwd = str(user.passwd)
+        cached = _get_cached_user(uid)
+        expected_pwd = str(cached.passwd)
         expected = ':'.join([uid, exp, expected_pwd, _SESSION_COOKIE_SALT])
         if hashlib.md5(expected).hexdigest()!=md5:
             raise ValueError('bad cookie: unexpected md5.')
-        # clear password in memory:
+        # copy user and clear password:
+        user = Dict(**cached)
         user.passwd = '******'
         return user
     except BaseException, e:
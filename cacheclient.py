@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Cache clients of redis and memcache with incrs(), which increases many counters
+by deltas, and create_client() to create cache client by cache conf:
+
+    cache.client = cacheclient.create_client(conf.cache)
+
+Every client created has incrs(deltas) besides get, set, delete, incr, getint,
+getints and gets, so counters can be flushed without knowing the backend.
+'''
+
+from transwarp import cache
+
+import codec, localcache
+
+class RedisClient(cache.RedisClient):
+    '''
+    Redis client that increases counters by one pipeline.
+    '''
+
+    def incrs(self, deltas, timeout=0):
+        '''
+        Increase counters by deltas as dict of key -> delta, and return new
+        values as list. If timeout > 0, counters expire after timeout seconds.
+        '''
+        p = self._client.pipeline(transaction=False)
+        for key, delta in deltas.iteritems():
+            p.incrby(key, delta)
+            if timeout:
+                p.expire(key, timeout)
+        L = p.execute()
+        return L[::2] if timeout else L
+
+class MemcacheClient(cache.MemcacheClient):
+    '''
+    Memcache client that increases counters one by one, since memcache has no
+    batch incr. Counters of memcache never go below 0.
+    '''
+
+    def incrs(self, deltas, timeout=0):
+        '''
+        Increase counters by deltas as dict of key -> delta, and return new
+        values as list. If timeout > 0, new counters expire after timeout seconds.
+        '''
+        L = []
+        for key, delta in deltas.iteritems():
+            if delta < 0:
+                L.append(self._client.decr(key, -delta))
+                continue
+            n = self._client.incr(key, delta)
+            if n is None:
+                # add may fail if other process added the key just now:
+                n = delta if self._client.add(key, str(delta), timeout) else self._client.incr(key, delta)
+            L.append(n)
+        return L
+
+def create_client(conf_cache):
+    '''
+    Create cache client by cache conf as dict, e.g. dict(type='redis', host='localhost').
+    The client is wrapped by codec.CodecClient.
+
+    >>> c = create_client(dict(type='local'))
+    >>> c.incrs(dict(a=1)), c.getint('a')
+    ([1], 1)
+    '''
+    t = conf_cache['type']
+    host = conf_cache.get('host', 'localhost')
+    if t=='redis':
+        client = RedisClient(host)
+    elif t=='memcache':
+        client = MemcacheClient(host)
+    elif t=='local':
+        # only for site running in one process:
+        client = localcache.LocalClient(max_bytes=conf_cache.get('max_bytes', 64 * 1024 * 1024))
+    else:
+        raise ValueError('bad cache type: %s' % t)
+    if t!='local' and conf_cache.get('near_cache', False):
+        client = localcache.NearClient(client)
+    return codec.CodecClient(client)
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Codec of cached values.
+
+CodecClient wraps a cache client and encodes values by a codec before set and
+decodes values after get:
+
+    cache.client = codec.CodecClient(cache.RedisClient('localhost'))
+
+An encoded value is a str with a header of magic, format version and flags.
+Values of other format versions are treated as missing, so changing the format
+never poisons the cache. Values written by incr(), and int values of set() are
+stored as they are, so counters work with incr() and getint().
+'''
+
+import zlib, logging, threading, cPickle
+
+# header of encoded value: magic, format version, flags:
+_MAGIC = '\xfe\xca'
+FORMAT_VERSION = 1
+
+_FLAG_PICKLED = 1
+_FLAG_ZLIB = 2
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+def key_prefix(key):
+    '''
+    Get prefix of cache key for stats.
+
+    >>> key_prefix('__FEED__@123:all/rss:5')
+    '__FEED__'
+    >>> key_prefix('123--get_site--www.example.com')
+    'get_site'
+    >>> key_prefix('plain')
+    'plain'
+    '''
+    if '@' in key:
+        return key.split('@', 1)[0]
+    if '--' in key:
+        return key.split('--')[1]
+    return key
+
+class Codec(object):
+    '''
+    Encode str as it is, and other values by binary pickle. Encoded values
+    larger than min_size are compressed by zlib.
+
+    >>> c = Codec()
+    >>> c.decode(c.encode('hello'))
+    'hello'
+    >>> d = dict(id=u'001', name=u'Michael', tags=[u'a', u'b'], version=3)
+    >>> c.decode(c.encode(d))==d
+    True
+    >>> s = 'abc' * 1000
+    >>> len(c.encode(s)) < 100
+    True
+    >>> c.decode(c.encode(s))==s
+    True
+    >>> c.decode('1024')
+    '1024'
+    >>> Codec(version=2).decode(c.encode('hello')) is None
+    True
+    '''
+
+    def __init__(self, version=FORMAT_VERSION, min_size=COMPRESS_MIN_SIZE, level=COMPRESS_LEVEL):
+        self._header = _MAGIC + chr(version)
+        self._min_size = min_size
+        self._level = level
+
+    def encode(self, value):
+        flags = 0
+        if not isinstance(value, str):
+            value = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+            flags = flags | _FLAG_PICKLED
+        if len(value) >= self._min_size:
+            z = zlib.compress(value, self._level)
+            if len(z) < len(value):
+                value = z
+                flags = flags | _FLAG_ZLIB
+        return '%s%s%s' % (self._header, chr(flags), value)
+
+    def decode(self, data):
+        if not isinstance(data, str) or not data.startswith(_MAGIC):
+            # raw value, e.g. counter:
+            return data
+        if not data.startswith(self._header):
+            return None
+        flags = ord(data[3])
+        value = data[4:]
+        if flags & _FLAG_ZLIB:
+            value = zlib.decompress(value)
+        if flags & _FLAG_PICKLED:
+            value = cPickle.loads(value)
+        return value
+
+class CodecClient(object):
+    '''
+    Cache client that encodes values by codec, and counts bytes stored per
+    key prefix.
+    '''
+
+    def __init__(self, client, codec=None):
+        self._cache = client
+        self._codec = codec or Codec()
+        self._lock = threading.Lock()
+        self._stats = dict()
+
+    def __getattr__(self, name):
+        # incr, decr, getint, getints and others are not encoded:
+        return getattr(self._cache, name)
+
+    def _count(self, key, size):
+        prefix = key_prefix(key)
+        with self._lock:
+            st = self._stats.get(prefix)
+            if st is None:
+                st = self._stats[prefix] = dict(sets=0, bytes=0)
+            st['sets'] = st['sets'] + 1
+            st['bytes'] = st['bytes'] + size
+
+    def _decode(self, data):
+        try:
+            return self._codec.decode(data)
+        except Exception, e:
+            logging.warning('failed to decode cached value: %s' % e)
+            return None
+
+    def get(self, key, default=None):
+        r = self._cache.get(key)
+        if r is None:
+            return default
+        r = self._decode(r)
+        return default if r is None else r
+
+    def gets(self, *keys):
+        return [None if r is None else self._decode(r) for r in self._cache.gets(*keys)]
+
+    def set(self, key, value, *args, **kw):
+        if type(value) in (int, long):
+            return self._cache.set(key, value, *args, **kw)
+        data = self._codec.encode(value)
+        self._count(key, len(data))
+        return self._cache.set(key, data, *args, **kw)
+
+    def delete(self, key):
+        return self._cache.delete(key)
+
+    def stats(self):
+        '''
+        Get counters of set calls and bytes stored per key prefix in current
+        process, as dict.
+        '''
+        with self._lock:
+            return dict(((k, dict(v)) for k, v in self._stats.iteritems()))
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
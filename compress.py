@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Gzip compression of responses.
+
+GzipMiddleware compresses responses of text content types if the client
+accepts gzip. Responses that already have header Content-Encoding, e.g. pages
+served by PageCacheMiddleware with precompressed bytes, are not touched.
+Responses of wsgi.file_wrapper are not compressed so files are still sent by
+sendfile. The ETag of gzip response has suffix '-gzip', and both gzip and
+identity responses of text content types have header Vary: Accept-Encoding.
+'''
+
+import gzip, zlib, logging
+
+from StringIO import StringIO
+
+MIN_SIZE = 1024
+LEVEL = 6
+
+_COMPRESSIBLE_TYPES = set(['text/html', 'text/plain', 'text/css', 'text/xml', 'text/javascript', \
+        'application/json', 'application/javascript', 'application/xml', 'application/rss+xml', 'application/atom+xml'])
+
+def accepts_gzip(environ):
+    '''
+    Test if client accepts gzip encoding.
+
+    >>> accepts_gzip(dict(HTTP_ACCEPT_ENCODING='gzip, deflate'))
+    True
+    >>> accepts_gzip(dict(HTTP_ACCEPT_ENCODING='deflate, gzip;q=0'))
+    False
+    >>> accepts_gzip(dict())
+    False
+    '''
+    for enc in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        parts = [p.strip() for p in enc.split(';')]
+        if parts[0].lower() in ('gzip', '*'):
+            return not ('q=0' in parts or 'q=0.0' in parts)
+    return False
+
+def is_compressible(headers):
+    '''
+    Test if response of headers can be compressed.
+
+    >>> is_compressible([('Content-Type', 'text/html; charset=utf-8')])
+    True
+    >>> is_compressible([('Content-Type', 'image/png')])
+    False
+    >>> is_compressible([('Content-Type', 'text/html'), ('Content-Encoding', 'gzip')])
+    False
+    '''
+    ctype = None
+    for k, v in headers:
+        lk = k.lower()
+        if lk=='content-encoding':
+            return False
+        if lk=='content-type':
+            ctype = v.split(';')[0].strip().lower()
+    return ctype in _COMPRESSIBLE_TYPES
+
+def gzip_bytes(body, level=LEVEL):
+    '''
+    Compress str by gzip.
+
+    >>> s = 'hello, world! ' * 100
+    >>> gunzip_bytes(gzip_bytes(s))==s
+    True
+    '''
+    buf = StringIO()
+    g = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0)
+    g.write(body)
+    g.close()
+    return buf.getvalue()
+
+def gunzip_bytes(body):
+    return gzip.GzipFile(fileobj=StringIO(body), mode='rb').read()
+
+_GZIP_SUFFIX = '-gzip'
+
+def gzip_etag(etag):
+    '''
+    Get ETag of gzip response from ETag of plain response.
+
+    >>> gzip_etag('"abc"'), gzip_etag('W/"abc"'), gzip_etag('"abc-gzip"')
+    ('"abc-gzip"', 'W/"abc-gzip"', '"abc-gzip"')
+    '''
+    if not etag.endswith('"') or etag.endswith('%s"' % _GZIP_SUFFIX):
+        return etag
+    return '%s%s"' % (etag[:-1], _GZIP_SUFFIX)
+
+def _vary(headers):
+    '''
+    Get value of header Vary with Accept-Encoding merged into existing values.
+
+    >>> _vary([('Vary', 'Cookie')]), _vary([]), _vary([('Vary', 'accept-encoding')]), _vary([('Vary', '*')])
+    ('Cookie, Accept-Encoding', 'Accept-Encoding', 'accept-encoding', '*')
+    '''
+    values = []
+    for k, v in headers:
+        if k.lower()=='vary':
+            values.extend([x.strip() for x in v.split(',') if x.strip()])
+    if '*' in values:
+        return '*'
+    if not 'accept-encoding' in [x.lower() for x in values]:
+        values.append('Accept-Encoding')
+    return ', '.join(values)
+
+def identity_headers(headers):
+    '''
+    Make headers of plain response that may be compressed for other clients.
+
+    >>> identity_headers([('Content-Type', 'text/html'), ('Vary', 'Cookie')])
+    [('Content-Type', 'text/html'), ('Vary', 'Cookie, Accept-Encoding')]
+    '''
+    L = [h for h in headers if h[0].lower()!='vary']
+    L.append(('Vary', _vary(headers)))
+    return L
+
+def gzip_headers(headers, length=None):
+    '''
+    Make headers of gzip response from headers of plain response.
+
+    >>> gzip_headers([('Content-Type', 'text/html'), ('ETag', '"abc"'), ('Content-Length', '2048')], 512)
+    [('Content-Type', 'text/html'), ('ETag', '"abc-gzip"'), ('Content-Encoding', 'gzip'), ('Vary', 'Accept-Encoding'), ('Content-Length', '512')]
+    '''
+    L = [(k, gzip_etag(v)) if k.lower()=='etag' else (k, v) for k, v in headers if k.lower()!='content-length' and k.lower()!='vary']
+    L.append(('Content-Encoding', 'gzip'))
+    L.append(('Vary', _vary(headers)))
+    if length is not None:
+        L.append(('Content-Length', str(length)))
+    return L
+
+def not_modified_headers(environ, headers):
+    '''
+    Make headers of 304 response with the ETag that client sent in If-None-Match.
+
+    >>> not_modified_headers(dict(HTTP_IF_NONE_MATCH='"abc-gzip"'), [('ETag', '"abc"')])
+    [('ETag', '"abc-gzip"')]
+    >>> not_modified_headers(dict(HTTP_IF_NONE_MATCH='"abc"'), [('ETag', '"abc"')])
+    [('ETag', '"abc"')]
+    '''
+    inm = environ.get('HTTP_IF_NONE_MATCH', '')
+    return [(k, gzip_etag(v)) if k.lower()=='etag' and gzip_etag(v) in inm else (k, v) for k, v in headers]
+
+def _is_file(environ, r):
+    ' test if response is sent by wsgi.file_wrapper. '
+    fw = environ.get('wsgi.file_wrapper')
+    try:
+        return fw is not None and isinstance(r, fw)
+    except TypeError:
+        return False
+
+def _gzip_stream(chunks, level):
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for s in chunks:
+            if s:
+                c = z.compress(s)
+                if c:
+                    yield c
+        yield z.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+class GzipMiddleware(object):
+    '''
+    WSGI middleware that compresses text responses by gzip. A response of known
+    Content-Length less than min_size is not compressed, and a response without
+    Content-Length is compressed as stream.
+    '''
+
+    def __init__(self, app, min_size=MIN_SIZE, level=LEVEL):
+        self._app = app
+        self._min_size = min_size
+        self._level = level
+
+    def __call__(self, environ, start_response):
+        use_gzip = accepts_gzip(environ) and environ.get('REQUEST_METHOD')!='HEAD'
+        captured = []
+        def _start_response(status, headers, exc_info=None):
+            captured.append((status, headers, exc_info))
+            return lambda s: logging.warning('write() is not supported by GzipMiddleware.')
+        r = self._app(environ, _start_response)
+        if not captured:
+            # start_response is called when iterating body:
+            body = ''.join(r)
+            if hasattr(r, 'close'):
+                r.close()
+            r = [body]
+        status, headers, exc_info = captured[0]
+        if status.startswith('304'):
+            start_response(status, not_modified_headers(environ, headers), exc_info)
+            return r
+        if not status.startswith('200') or not is_compressible(headers):
+            start_response(status, headers, exc_info)
+            return r
+        if not use_gzip or _is_file(environ, r):
+            start_response(status, identity_headers(headers), exc_info)
+            return r
+        length = dict(((k.lower(), v) for k, v in headers)).get('content-length')
+        if length is not None and int(length) < self._min_size:
+            start_response(status, identity_headers(headers), exc_info)
+            return r
+        if isinstance(r, list):
+            body = ''.join(r)
+            if len(body) < self._min_size:
+                start_response(status, identity_headers(headers), exc_info)
+                return [body]
+            body = gzip_bytes(body, self._level)
+            start_response(status, gzip_headers(headers, len(body)), exc_info)
+            return [body]
+        start_response(status, gzip_headers(headers), exc_info)
+        return _gzip_stream(r, self._level)
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Conditional GET support by ETag and Last-Modified.
+
+A handler that wants 304 responses is decorated by @conditional(validator):
+
+@theme('article.html', page_cache=True)
+@conditional(_article_validator)
+@route('/article/<article_id>')
+def theme_get_article(article_id):
+    pass
+
+The validator is called with the same args of handler and returns a tuple of
+(versions, last_modified) by cheap queries, or None if validators cannot be
+computed. The handler is not called at all if the request is not modified.
+'''
+
+import hashlib, logging, functools
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+from transwarp.web import ctx
+
+import loader, pagecache, compress
+
+def make_etag(*parts):
+    '''
+    Make a strong ETag from parts.
+
+    >>> make_etag('123', 1, u'default')
+    '"918dd96b8ca10610619125cf3cdadd6d"'
+    '''
+    s = u'|'.join([p if isinstance(p, unicode) else unicode(str(p), 'utf-8') for p in parts])
+    return '"%s"' % hashlib.md5(s.encode('utf-8')).hexdigest()
+
+def etag_matches(if_none_match, etag):
+    '''
+    Test if ETag matches the value of header If-None-Match by weak comparison
+    (RFC 7232), so W/ prefix is ignored. The ETag of gzip response made by
+    compress.gzip_etag() matches too.
+
+    >>> etag_matches('"abc", "xyz"', '"xyz"')
+    True
+    >>> etag_matches('"xyz-gzip"', '"xyz"')
+    True
+    >>> etag_matches('*', '"xyz"')
+    True
+    >>> etag_matches('W/"xyz"', '"xyz"'), etag_matches('W/"xyz-gzip"', '"xyz"')
+    (True, True)
+    >>> etag_matches('W/"abc"', '"xyz"')
+    False
+    >>> etag_matches('', '"xyz"')
+    False
+    '''
+    if not if_none_match:
+        return False
+    etag = _opaque_tag(etag)
+    tags = (etag, compress.gzip_etag(etag))
+    for t in if_none_match.split(','):
+        t = t.strip()
+        if t=='*' or _opaque_tag(t) in tags:
+            return True
+    return False
+
+def _opaque_tag(etag):
+    ' get opaque tag of ETag without weak prefix W/. '
+    return etag[2:] if etag.startswith('W/') else etag
+
+def not_modified_since(if_modified_since, last_modified):
+    '''
+    Test if resource was not modified since the value of header If-Modified-Since.
+
+    >>> not_modified_since('Sun, 06 Nov 1994 08:49:37 GMT', 784111777.5)
+    True
+    >>> not_modified_since('Sun, 06 Nov 1994 08:49:37 GMT', 784111778.0)
+    False
+    >>> not_modified_since('bad date', 784111777.0)
+    False
+    '''
+    if not if_modified_since or last_modified is None:
+        return False
+    t = parsedate_tz(if_modified_since)
+    if t is None:
+        return False
+    return int(last_modified) <= mktime_tz(t)
+
+def http_date(ts):
+    '''
+    Format timestamp as http date.
+
+    >>> http_date(784111777.5)
+    'Sun, 06 Nov 1994 08:49:37 GMT'
+    '''
+    return formatdate(ts, usegmt=True)
+
+def is_not_modified(etag, last_modified):
+    '''
+    Test current request by If-None-Match and If-Modified-Since. If-Modified-Since
+    is ignored if If-None-Match is present.
+    '''
+    inm = ctx.request.header('IF-NONE-MATCH')
+    if inm:
+        return etag_matches(inm, etag)
+    return not_modified_since(ctx.request.header('IF-MODIFIED-SINCE'), last_modified)
+
+def conditional(validator, use_theme=True):
+    '''
+    Make GET handler return 304 if not modified. The ETag is computed from website
+    id, page generation of website, versions returned by validator, active theme,
+    locale and current user.
+    '''
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kw):
+            v = validator(*args, **kw)
+            if v is None:
+                return func(*args, **kw)
+            versions, last_modified = v
+            parts = [ctx.website.id, pagecache.get_generation()]
+            parts.extend(versions)
+            if use_theme:
+                from plugin.theme import get_active_theme
+                parts.append(get_active_theme())
+            parts.append(loader.parse_locale(ctx.request.header('ACCEPT-LANGUAGE')))
+            parts.append(ctx.user.id if ctx.user else u'')
+            etag = make_etag(*parts)
+            ctx.response.set_header('ETag', etag)
+            if last_modified is not None:
+                ctx.response.set_header('Last-Modified', http_date(last_modified))
+            if is_not_modified(etag, last_modified):
+                logging.debug('not modified: %s' % etag)
+                ctx.response.status = 304
+                return []
+            return func(*args, **kw)
+        return _wrapper
+    return _decorator
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
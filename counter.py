@@ -3,31 +3,230 @@
 
 __author__ = 'Michael Liao'
 
-' counter module '
+'''
+counter module
 
-import logging
+Counters are increased in process and flushed to cache in batch every
+FLUSH_INTERVAL seconds. Counters of table rows are folded into column
+read_count of the table by fold_read_counts(), which is called by cron job,
+or by a thread of the wsgi process started by start_folding() if the cache is
+in process.
+
+Rollup counters are increased into hourly, daily and weekly buckets at the
+same time, so a range of days can be read without summing up hours. Buckets
+start at local midnight, and expire after ROLLUP_TIMEOUTS of the unit.
+'''
+
+import time, atexit, logging, threading
 
-from transwarp.web import ctx, view, get, post, route, Dict, Template, seeother, notfound, badrequest
 from transwarp import cache
 
+import util, rowcache
+
 _COUNTER_KEY = '__COUNTER__@%s'
 
-def inc(key):
+# every flush stores dirty (table, key) list with a sequence number:
+_DIRTY_SEQ_KEY = '__COUNTER_DIRTY__'
+_DIRTY_KEY = '__COUNTER_DIRTY__@%d'
+_DIRTY_TIMEOUT = 604800
+_FOLDED_KEY = '__COUNTER_FOLDED__'
+
+FLUSH_INTERVAL = 5.0
+FOLD_INTERVAL = 60
+FOLD_BATCH = 100
+FOLD_MAX_FLUSHES = 1000
+
+# set to False to stop counting in process, e.g. when exporting pages:
+enabled = True
+
+_lock = threading.Lock()
+_pending = dict()
+_timeouts = dict()
+_dirty = set()
+_last_flush = time.time()
+
+def inc(key, table=None, timeout=0):
     '''
-    Increase counter.
+    Increase counter in process. If table is not None, the counter will be
+    folded into read_count of the table row by id=key. If timeout > 0, the
+    counter in cache expires after timeout seconds.
+
+    Returns:
+        increments of the key that are not flushed yet.
 
     >>> key = uuid.uuid4().hex
     >>> inc(key)
     1
     '''
-    return cache.client.incr(_COUNTER_KEY % key)
+    if not enabled:
+        return 0
+    with _lock:
+        n = _pending.get(key, 0) + 1
+        _pending[key] = n
+        if timeout:
+            _timeouts[key] = timeout
+        if table:
+            _dirty.add((table, key))
+        expired = time.time() - _last_flush >= FLUSH_INTERVAL
+    if expired:
+        flush()
+    return n
+
+def flush():
+    '''
+    Flush counters increased in process to cache.
+    '''
+    global _last_flush
+    with _lock:
+        pending = _pending.copy()
+        timeouts = _timeouts.copy()
+        dirty = list(_dirty)
+        _pending.clear()
+        _timeouts.clear()
+        _dirty.clear()
+        _last_flush = time.time()
+    if not pending:
+        return
+    try:
+        groups = dict()
+        for k, n in pending.iteritems():
+            groups.setdefault(timeouts.get(k, 0), dict())[_COUNTER_KEY % k] = n
+        for timeout, deltas in groups.iteritems():
+            cache.client.incrs(deltas, timeout)
+        if dirty:
+            seq = cache.client.incr(_DIRTY_SEQ_KEY)
+            cache.client.set(_DIRTY_KEY % seq, dirty, _DIRTY_TIMEOUT)
+    except Exception, e:
+        logging.exception('failed to flush %d counters.' % len(pending))
+
+atexit.register(flush)
 
 def count(key):
     return cache.client.getint(_COUNTER_KEY % key)
 
 def counts(*keys):
+    ' get counters of keys by one call. '
     return cache.client.getints(map(lambda key: _COUNTER_KEY % key, keys))
 
+ROLLUP_HOUR = 'h'
+ROLLUP_DAY = 'd'
+ROLLUP_WEEK = 'w'
+
+_ROLLUP_SECONDS = {
+    ROLLUP_HOUR: 3600,
+    ROLLUP_DAY: 86400,
+    ROLLUP_WEEK: 604800,
+}
+
+ROLLUP_TIMEOUTS = {
+    ROLLUP_HOUR: 86400 * 15,
+    ROLLUP_DAY: 86400 * 400,
+    ROLLUP_WEEK: 86400 * 1100,
+}
+
+def _utc_offset(ts):
+    ' get offset of local time to utc in seconds at timestamp. '
+    return -(time.altzone if time.daylight and time.localtime(ts).tm_isdst > 0 else time.timezone)
+
+def rollup_key(name, unit, n):
+    '''
+    Get key of the n-th bucket of unit.
+
+    >>> rollup_key('traffic_123', ROLLUP_DAY, 16000)
+    'traffic_123_d16000'
+    '''
+    return '%s_%s%d' % (name, unit, n)
+
+def rollup_index(unit, ts):
+    '''
+    Get bucket index of unit at timestamp. Buckets of day start at local midnight.
+
+    >>> t = time.mktime((2014, 3, 5, 0, 0, 0, 0, 0, -1))
+    >>> rollup_index(ROLLUP_DAY, t) - rollup_index(ROLLUP_DAY, t - 1)
+    1
+    >>> rollup_index(ROLLUP_DAY, t + 86399) - rollup_index(ROLLUP_DAY, t)
+    0
+    >>> rollup_time(ROLLUP_DAY, rollup_index(ROLLUP_DAY, t + 3600))==t
+    True
+    '''
+    return int(ts + _utc_offset(ts)) // _ROLLUP_SECONDS[unit]
+
+def rollup_time(unit, n):
+    ' get timestamp when the n-th bucket of unit starts. '
+    t = n * _ROLLUP_SECONDS[unit]
+    return t - _utc_offset(t)
+
+def inc_rollups(name, ts=None):
+    '''
+    Increase hourly, daily and weekly counters of name.
+    '''
+    t = ts or time.time()
+    for unit in (ROLLUP_HOUR, ROLLUP_DAY, ROLLUP_WEEK):
+        inc(rollup_key(name, unit, rollup_index(unit, t)), timeout=ROLLUP_TIMEOUTS[unit])
+
+def get_rollups(name, unit, start, end):
+    '''
+    Get counters of buckets from start to end (exclusive) as list of int.
+    '''
+    return [int(n or 0) for n in counts(*[rollup_key(name, unit, i) for i in range(start, end)])]
+
+def fold_read_counts():
+    '''
+    Decrease the cache counters of table rows, and fold the decreased values
+    into read_count of table rows with bulk updates.
+
+    Returns:
+        total number of folded counts.
+    '''
+    seq = cache.client.getint(_DIRTY_SEQ_KEY) or 0
+    folded = int(cache.client.get(_FOLDED_KEY) or 0)
+    if folded >= seq:
+        return 0
+    ns = range(folded + 1, min(seq, folded + FOLD_MAX_FLUSHES) + 1)
+    tables = dict()
+    for n, entry in zip(ns, cache.client.gets(*[_DIRTY_KEY % n for n in ns])):
+        if entry is None and seq - n < 10:
+            # the entry of a recent flush may be not stored yet:
+            break
+        folded = n
+        for table, key in (entry or ()):
+            tables.setdefault(table, set()).add(key)
+    total = 0
+    for table, keys in tables.iteritems():
+        keys = list(keys)
+        for pos in range(0, len(keys), FOLD_BATCH):
+            batch = keys[pos:pos + FOLD_BATCH]
+            deltas = dict(((k, int(c)) for k, c in zip(batch, counts(*batch)) if c))
+            if deltas:
+                # decrease cache counters first, so a crash before db update
+                # loses these counts but never counts them twice:
+                cache.client.incrs(dict(((_COUNTER_KEY % k, -c) for k, c in deltas.iteritems())))
+                util.bulk_update(table, 'read_count', deltas, increment=True)
+                rowcache.delete(table, *deltas.keys())
+                total = total + sum(deltas.itervalues())
+    cache.client.set(_FOLDED_KEY, folded)
+    logging.info('folded %d counts into read_count.' % total)
+    return total
+
+def _fold_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+            fold_read_counts()
+        except BaseException, e:
+            logging.exception('Fold error.')
+
+def start_folding(interval=FOLD_INTERVAL):
+    '''
+    Start a daemon thread that folds counters every interval seconds, for a
+    site of in process cache that cannot be folded by cron job.
+    '''
+    t = threading.Thread(target=_fold_loop, args=(interval,), name='counter-fold')
+    t.daemon = True
+    t.start()
+    return t
+
 if __name__=='__main__':
     import uuid, doctest
     doctest.testmod()
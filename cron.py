@@ -11,11 +11,13 @@ import logging; logging.basicConfig(level=logging.DEBUG)
 
 from datetime import datetime
 
-from transwarp import db, task, mail
+from transwarp import db, cache, task, mail
 
 from apiexporter import *
 
-import setting
+import setting, counter, cacheclient
+
+FOLD_INTERVAL = counter.FOLD_INTERVAL
 
 def cron_job():
     print 'cron job start...'
@@ -39,13 +41,24 @@ def cron_job():
     else:
         task.set_task_result(t['id'], t['execution_id'], True, 'sent at %s' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
-def cron_loop():
+def fold_job():
+    print 'fold job start...'
+    counter.fold_read_counts()
+
+def cron_loop(fold=True):
+    last_fold = 0
     while True:
         time.sleep(10)
         try:
             cron_job()
         except BaseException, e:
             logging.exception('Cron error.')
+        if fold and time.time() - last_fold >= FOLD_INTERVAL:
+            last_fold = time.time()
+            try:
+                fold_job()
+            except BaseException, e:
+                logging.exception('Fold error.')
 
 if __name__=='__main__':
     import conf_prod
@@ -56,4 +69,8 @@ if __name__=='__main__':
             db_user = conf_prod.db.get('user', 'www-data'), \
             db_password = conf_prod.db.get('password', 'www-data'), \
             use_unicode = True, charset = 'utf8')
-    cron_loop()
+    cache.client = cacheclient.create_client(conf_prod.cache)
+    if conf_prod.cache['type']=='local':
+        # counters in process cache of wsgi are folded by wsgi process:
+        logging.warning('cache type is local, cron job does not fold counters.')
+    cron_loop(fold=conf_prod.cache['type']!='local')
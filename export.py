@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Export a website as static files that can be served by nginx directly:
+
+python export.py www.example.com /srv/static/www.example.com [--full]
+
+Pages are rendered by the app of wsgi.create_app(), so static pages are the
+same as dynamic pages. Each page is written as <path>/index.html (feed as
+<path>/index.xml) with a .gz variant, and a .br variant if module brotli is
+installed. Pages of objects whose version did not change since last export
+are skipped unless --full is given. Rendered pages are not counted as reads.
+Listings are exported page by page by following their cursor links, and page n
+is written as <path>/page/<n>/index.html with links rewritten to these paths.
+
+nginx config example:
+
+    location / {
+        gzip_static on;
+        index index.html index.xml;
+        try_files $uri $uri/ =404;
+    }
+'''
+
+import os, re, sys, gzip, json, hashlib, logging
+
+from wsgiref.util import setup_testing_defaults
+from StringIO import StringIO
+
+from transwarp import db
+
+import generation, counter, wsgi
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_MANIFEST = '.export.json'
+
+# cursor links of listings made by util.select_page(), e.g. href="?after=xxx&page=2":
+_RE_PAGING_LINK = re.compile(r'href="\?((?:after|before)=[^&"]*&(?:amp;)?page=(\d+))"')
+
+def render(app, domain, path, query=''):
+    '''
+    Render path of website by app as anonymous GET request.
+
+    Returns:
+        (status, body as str)
+    '''
+    environ = dict(REQUEST_METHOD='GET', PATH_INFO=path, QUERY_STRING=query, HTTP_HOST=domain, SERVER_NAME=domain, HTTP_ACCEPT_LANGUAGE='en')
+    environ['wsgi.input'] = StringIO('')
+    setup_testing_defaults(environ)
+    captured = []
+    def _start_response(status, headers, exc_info=None):
+        captured.append(status)
+    r = app(environ, _start_response)
+    body = ''.join(r)
+    if hasattr(r, 'close'):
+        r.close()
+    return captured[0], body
+
+def page_path(path, n):
+    '''
+    Get static path of the n-th page of listing path.
+
+    >>> page_path('/articles', 1)
+    '/articles'
+    >>> page_path('/category/123', 3)
+    '/category/123/page/3'
+    '''
+    return path if n==1 else '%s/page/%d' % (path, n)
+
+def render_pages(app, domain, path):
+    '''
+    Render path and, if it is a listing, all its pages by following the cursor
+    links. Cursor links are rewritten to static paths of pages, which can be
+    served without query string.
+
+    Returns:
+        list of (path, status, body as str)
+    '''
+    L = []
+    query, n = '', 1
+    while True:
+        status, body = render(app, domain, path, query)
+        links = _RE_PAGING_LINK.findall(body)
+        body = _RE_PAGING_LINK.sub(lambda m: 'href="%s"' % page_path(path, int(m.group(2))), body)
+        L.append((page_path(path, n), status, body))
+        nexts = [(q.replace('&amp;', '&'), int(i)) for q, i in links if q.startswith('after=') and int(i) > n]
+        if not status.startswith('200') or not nexts:
+            return L
+        query, n = nexts[0]
+
+def _file_of(root, path):
+    name = 'index.xml' if path.startswith('/feed') else 'index.html'
+    return os.path.join(root, path.strip('/'), name)
+
+def _write(fpath, body):
+    d = os.path.dirname(fpath)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    with open(fpath, 'wb') as f:
+        f.write(body)
+    with open('%s.gz' % fpath, 'wb') as f:
+        g = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0)
+        g.write(body)
+        g.close()
+    if brotli:
+        with open('%s.br' % fpath, 'wb') as f:
+            f.write(brotli.compress(body))
+
+def _remove(fpath):
+    for p in (fpath, '%s.gz' % fpath, '%s.br' % fpath):
+        if os.path.isfile(p):
+            os.remove(p)
+
+def get_pages(website_id):
+    '''
+    Get pages of website as dict of path -> version key. Listing pages always
+    have version key None so they are exported every time.
+    '''
+    # settings, texts, navigations, theme and categories are shown on every page:
+    cats = db.select('select id, version from categories where website_id=?', website_id)
+    cats_hash = hashlib.md5(repr(sorted([(c.id, c.version) for c in cats]))).hexdigest()
+    site = '%s.%s' % (generation.get('settings:%s' % website_id), cats_hash)
+    pages = {'/articles': None, '/feed': None}
+    for c in cats:
+        pages['/category/%s' % c.id] = None
+    for a in db.select('select id, version from articles where website_id=? and draft=?', website_id, False):
+        pages['/article/%s' % a.id] = '%s:%s' % (site, a.version)
+    for p in db.select('select id, version from pages where website_id=? and draft=?', website_id, False):
+        pages['/page/%s' % p.id] = '%s:%s' % (site, p.version)
+    for w in db.select('select id, version from wikis where website_id=?', website_id):
+        # sidebar of wiki pages is changed with generation of wiki:
+        wiki = '%s:%s' % (site, generation.get('wiki:%s' % w.id))
+        pages['/wiki/%s' % w.id] = '%s:%s' % (wiki, w.version)
+        for p in db.select('select id, version from wiki_pages where wiki_id=?', w.id):
+            pages['/wiki/%s/%s' % (w.id, p.id)] = '%s:%s' % (wiki, p.version)
+    return pages
+
+def export(domain, root, full=False):
+    '''
+    Export website to root directory.
+
+    Returns:
+        (number of exported pages, number of skipped pages, number of removed pages)
+    '''
+    app = wsgi.create_app(False)
+    counter.enabled = False
+    website = db.select_one('select * from websites where domain=?', domain)
+    if website is None:
+        raise ValueError('website not found: %s' % domain)
+    mpath = os.path.join(root, _MANIFEST)
+    manifest = dict()
+    if not full and os.path.isfile(mpath):
+        with open(mpath, 'rb') as f:
+            manifest = json.load(f)
+    pages = get_pages(website.id)
+    paths = set(pages.iterkeys())
+    exported, skipped = 0, 0
+    for path, version in sorted(pages.iteritems()):
+        if version is not None and manifest.get(path)==version:
+            skipped = skipped + 1
+            continue
+        for p, status, body in render_pages(app, domain, path):
+            if not status.startswith('200'):
+                logging.warning('skip %s: %s' % (p, status))
+                continue
+            _write(_file_of(root, p), body)
+            manifest[p] = version
+            paths.add(p)
+            exported = exported + 1
+    removed = 0
+    for path in manifest.keys():
+        if not path in paths:
+            _remove(_file_of(root, path))
+            manifest.pop(path)
+            removed = removed + 1
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    with open(mpath, 'wb') as f:
+        json.dump(manifest, f)
+    return exported, skipped, removed
+
+if __name__=='__main__':
+    args = [a for a in sys.argv[1:] if a!='--full']
+    if len(args)!=2:
+        print 'Usage: python export.py <domain> <output-dir> [--full]'
+        exit(1)
+    logging.basicConfig(level=logging.INFO)
+    print 'exported %d, skipped %d, removed %d pages.' % export(args[0], args[1], '--full' in sys.argv)
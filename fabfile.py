@@ -20,9 +20,10 @@ _REMOTE_DIST_LINK = '/srv/itranswarp.com/www'
 _REMOTE_DIST_DIR = '/srv/itranswarp.com/www-%s' % datetime.now().strftime('%y-%m-%d_%H.%M.%S')
 
 def build(*files):
-    includes = ['apps', 'i18n', 'plugin', 'static', 'templates', 'transwarp', 'admin.py', 'apiexporter.py', 'async.py', 'auth.py', 'conf_prod.py', 'counter.py', 'cron.py', 'html.py', 'install.py', 'loader.py', 'markdown2.py', 'setting.py', 'thumbnail.py', 'wsgi.py', 'wsgiapp.py']
+    includes = ['apps', 'i18n', 'plugin', 'static', 'templates', 'transwarp', 'admin.py', 'apiexporter.py', 'assets.py', 'async.py', 'auth.py', 'cacheclient.py', 'codec.py', 'compress.py', 'conditional.py', 'conf_prod.py', 'counter.py', 'cron.py', 'export.py', 'feed.py', 'generation.py', 'html.py', 'install.py', 'loader.py', 'localcache.py', 'lru.py', 'markdown2.py', 'pagecache.py', 'rowcache.py', 'schema.py', 'setting.py', 'thumbnail.py', 'util.py', 'wsgi.py', 'wsgiapp.py']
     includes.extend(files)
     excludes = ['.*', '*.pyc', '*.pyo', '*.psd', 'static/css/less/*', 'static/upload/*']
+    local('python assets.py')
     local('rm -f %s' % _TAR_FILE)
     cmd = ['tar', '--dereference', '-czvf', _TAR_FILE]
     cmd.extend(['--exclude=\'%s\'' % ex for ex in excludes])
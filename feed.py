@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Feed module that generates RSS 2.0 and Atom 1.0 feeds as generators of str.
+
+Feed generators are called after the response is returned, when ctx is
+already unbound, so all data must be loaded before making the generator:
+
+    items = [Dict(title=a.name, link=..., author=a.user_name, ...) for a in articles]
+    return feed.cached_feed('all/rss', gen, lambda: feed.rss(title, link, description, items))
+'''
+
+from datetime import datetime
+
+from transwarp.web import ctx, UTC_0
+from transwarp import cache
+
+from apiexporter import acquire_lock, release_lock, wait_cached
+
+_FEED_KEY = '__FEED__@%s:%s:%s'
+_FEED_TIMEOUT = 86400
+_FEED_WAIT = 3
+
+def _to_str(s):
+    if isinstance(s, str):
+        return s
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return str(s)
+
+def _cdata(s):
+    '''
+    Make CDATA section.
+
+    >>> _cdata(u'a]]>b')
+    '<![CDATA[a]]]]><![CDATA[>b]]>'
+    '''
+    return '<![CDATA[%s]]>' % _to_str(s).replace(']]>', ']]]]><![CDATA[>')
+
+def _escape(s):
+    '''
+    Escape xml text.
+
+    >>> _escape(u'a<b>&"c"')
+    'a&lt;b&gt;&amp;&quot;c&quot;'
+    '''
+    return _to_str(s).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+def rss_datetime(ts):
+    '''
+    Format timestamp as RFC 822 date time.
+
+    >>> rss_datetime(0)
+    'Thu, 01 Jan 1970 00:00:00 GMT'
+    '''
+    return datetime.fromtimestamp(ts, UTC_0).strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+def atom_datetime(ts):
+    '''
+    Format timestamp as RFC 3339 date time.
+
+    >>> atom_datetime(0)
+    '1970-01-01T00:00:00Z'
+    '''
+    return datetime.fromtimestamp(ts, UTC_0).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def rss(title, link, description, items, build_time):
+    '''
+    Generate RSS 2.0 feed. Each item has title, link, author, published, updated
+    and html.
+    '''
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel><title>'
+    yield _cdata(title)
+    yield '</title><link>%s</link><description>' % _escape(link)
+    yield _cdata(description)
+    yield '</description><lastBuildDate>%s</lastBuildDate><generator>iTranswarp</generator><ttl>30</ttl>' % rss_datetime(build_time)
+    for it in items:
+        yield '<item><title>%s</title><link>%s</link><guid>%s</guid><author>%s</author><pubDate>%s</pubDate><description>%s</description></item>' \
+            % (_cdata(it.title), _escape(it.link), _escape(it.link), _cdata(it.author), rss_datetime(it.published), _cdata(it.html))
+    yield '</channel></rss>'
+
+def atom(title, link, feed_url, subtitle, items, updated):
+    '''
+    Generate Atom 1.0 feed. Each item has title, link, author, published, updated
+    and html.
+    '''
+    yield '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom"><title>'
+    yield _escape(title)
+    yield '</title><subtitle>%s</subtitle><link href="%s" /><link rel="self" href="%s" /><id>%s</id><updated>%s</updated><generator>iTranswarp</generator>' \
+        % (_escape(subtitle), _escape(link), _escape(feed_url), _escape(feed_url), atom_datetime(updated))
+    for it in items:
+        yield '<entry><title>%s</title><link href="%s" /><id>%s</id><author><name>%s</name></author><published>%s</published><updated>%s</updated><content type="html">%s</content></entry>' \
+            % (_escape(it.title), _escape(it.link), _escape(it.link), _escape(it.author), atom_datetime(it.published), atom_datetime(it.updated), _cdata(it.html))
+    yield '</feed>'
+
+def _tee(key, chunks, lk):
+    L = []
+    try:
+        for s in chunks:
+            L.append(s)
+            yield s
+        cache.client.set(key, ''.join(L), _FEED_TIMEOUT)
+    finally:
+        if lk:
+            release_lock(lk)
+
+def cached_feed(name, generation, make_feed):
+    '''
+    Get feed of current website by name and generation. A cached feed is returned
+    as one str in list, otherwise the generator returned by make_feed() is
+    streamed, and cached after all chunks are sent. Only one process makes the
+    feed while others wait for at most _FEED_WAIT seconds.
+    '''
+    key = _FEED_KEY % (ctx.website.id, name, generation)
+    body = cache.client.get(key)
+    if body is not None:
+        return [body]
+    lk = acquire_lock(key)
+    if lk is None:
+        body = wait_cached(key, _FEED_WAIT)
+        if body is not None:
+            return [body]
+    return _tee(key, make_feed(), lk)
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
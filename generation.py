@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Generation counters stored in cache. A cached object remembers the generation
+when it was built, and is treated as expired once the generation was bumped.
+'''
+
+from transwarp import cache
+
+_GENERATION_KEY = '__GENERATION__@%s'
+
+def get(name):
+    ' get current generation by name, 0 if never bumped. '
+    return cache.client.getint(_GENERATION_KEY % name) or 0
+
+def gets(*names):
+    ' get current generations by names as list. '
+    return [n or 0 for n in cache.client.getints([_GENERATION_KEY % name for name in names])]
+
+def bump(name):
+    ' bump generation by name and return the new generation. '
+    return cache.client.incr(_GENERATION_KEY % name)
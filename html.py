@@ -5,12 +5,26 @@ __author__ = 'Michael Liao'
 
 ' parse html and generate summary '
 
-import re, logging
+import re, time, logging, threading
 
 from HTMLParser import HTMLParser
 from htmlentitydefs import name2codepoint
 
-import markdown2
+from transwarp import db, cache
+
+import markdown2, lru, util
+
+_HTML_CACHE_KEY = '__HTML__@%s:%s:%s'
+_HTML_CACHE_TIMEOUT = 86400
+_HTML_LOCAL_MAX_BYTES = 32 * 1024 * 1024
+
+_local_htmls = lru.LRUCache(max_bytes=_HTML_LOCAL_MAX_BYTES)
+_shared_stats = dict(hits=0, misses=0)
+_shared_stats_lock = threading.Lock()
+
+def _count_shared(name):
+    with _shared_stats_lock:
+        _shared_stats[name] = _shared_stats[name] + 1
 
 class MyHTMLParser(HTMLParser):
 
@@ -77,8 +91,117 @@ class MyHTMLParser(HTMLParser):
 
 _RE_END_PARA = re.compile(ur'(\<\/)(p)|(div)|(pre)(\>)')
 
-def to_html(obj):
-    return markdown2.markdown(obj.content)
+def save_html(table, ref_id, version, content):
+    '''
+    Render markdown content and store the html by ref id and version.
+
+    Args:
+        table: the table name of ref object, e.g. 'articles'.
+        ref_id: the ref object id.
+        version: the version of ref object.
+        content: the markdown content.
+    Returns:
+        the rendered html as unicode.
+    '''
+    h = markdown2.markdown(content)
+    rendered = dict( \
+        id = ref_id, \
+        ref_type = table, \
+        version = version, \
+        content = h, \
+        creation_time = time.time())
+    util.upsert('rendered_htmls', **rendered)
+    cache.client.set(_HTML_CACHE_KEY % (table, ref_id, version), h, _HTML_CACHE_TIMEOUT)
+    return h
+
+def delete_html(ref_id):
+    db.update('delete from rendered_htmls where id=?', ref_id)
+
+def _load_html(obj, table):
+    hs = db.select('select content from rendered_htmls where id=? and version=?', obj.id, obj.version)
+    if hs:
+        return hs[0].content
+    logging.info('rendered html not found: %s %s@%s' % (table, obj.id, obj.version))
+    # obj of listing has no content column:
+    content = obj.content if 'content' in obj else db.select_one('select content from %s where id=?' % table, obj.id).content
+    try:
+        return save_html(table, obj.id, obj.version, content)
+    except Exception, e:
+        logging.exception('failed to store rendered html.')
+    return markdown2.markdown(content)
+
+def to_html(obj, table):
+    '''
+    Get html of obj which has id, version and content. The html is looked up in 
+    process-local LRU cache, then shared cache, then rendered html store, and 
+    rendered if not found. Cache key contains version so edits never hit old html.
+    '''
+    key = _HTML_CACHE_KEY % (table, obj.id, obj.version)
+    h = _local_htmls.get(key)
+    if h is not None:
+        return h
+    h = cache.client.get(key)
+    if h is None:
+        _count_shared('misses')
+        h = _load_html(obj, table)
+        cache.client.set(key, h, _HTML_CACHE_TIMEOUT)
+    else:
+        _count_shared('hits')
+    _local_htmls.set(key, h)
+    return h
+
+def to_htmls(objs, table):
+    '''
+    Get html of objs as list, same as to_html() but look up shared cache in one call.
+    '''
+    keys = [_HTML_CACHE_KEY % (table, obj.id, obj.version) for obj in objs]
+    L = [_local_htmls.get(key) for key in keys]
+    missing = [n for n, h in enumerate(L) if h is None]
+    if missing:
+        shared = cache.client.gets(*[keys[n] for n in missing])
+        for n, h in zip(missing, shared):
+            if h is None:
+                _count_shared('misses')
+                h = _load_html(objs[n], table)
+                cache.client.set(keys[n], h, _HTML_CACHE_TIMEOUT)
+            else:
+                _count_shared('hits')
+            _local_htmls.set(keys[n], h)
+            L[n] = h
+    return L
+
+def get_cache_stats():
+    '''
+    Get hit, miss and eviction counters of html cache as dict.
+    '''
+    with _shared_stats_lock:
+        shared = dict(_shared_stats)
+    return dict(local=_local_htmls.stats(), shared=shared)
+
+def backfill_htmls(table, batch=100):
+    '''
+    Render and store html for all rows of table which has no html of current version.
+
+    Returns:
+        number of rendered rows.
+    '''
+    n = 0
+    last_id = ''
+    while True:
+        L = db.select('select id, version, content from %s where id > ? order by id limit ?' % table, last_id, batch)
+        if not L:
+            break
+        last_id = L[-1].id
+        stored = db.select('select id, version from rendered_htmls where id in (%s)' % ','.join(['?'] * len(L)), *[r.id for r in L])
+        versions = dict(((r.id, r.version) for r in stored))
+        for r in L:
+            if versions.get(r.id)!=r.version:
+                save_html(table, r.id, r.version, r.content)
+                n = n + 1
+        logging.info('backfill %s: %d rendered, last id: %s' % (table, n, last_id))
+    return n
+
+BACKFILL_TABLES = ('articles', 'pages', 'wikis', 'wiki_pages')
 
 def parse(s, maxchars):
     L = _RE_END_PARA.split(s)
@@ -99,6 +222,19 @@ def parse_md(s, maxchars):
     return parse(h, maxchars)
 
 if __name__=='__main__':
+    import sys
+    if sys.argv[1:]==['backfill']:
+        import conf_prod
+        db.init(db_type = conf_prod.db.get('type', 'mysql'), \
+                db_schema = conf_prod.db.get('schema', 'itranswarp'), \
+                db_host = conf_prod.db.get('host', 'localhost'), \
+                db_port = conf_prod.db.get('port', 3306), \
+                db_user = conf_prod.db.get('user', 'www-data'), \
+                db_password = conf_prod.db.get('password', 'www-data'), \
+                use_unicode = True, charset = 'utf8')
+        for t in BACKFILL_TABLES:
+            print 'backfill %s: %d rendered.' % (t, backfill_htmls(t))
+        exit(0)
     s = u'<p>paragrah 1</p> <pre>hello, <span>world</span>!</pre> <p color=red><a>another papa</a></p> <br/> <img src="test.jpg" /> <div>END</div><h1>END</h1>'
     print parse(s, 12)
     print parse_md(u'*Hello, 你好！*', 12)
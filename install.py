@@ -94,7 +94,8 @@ r'''
         modified_time real not null,
         version bigint not null,
         primary key(id),
-        index idx_website_id(website_id)
+        index idx_website_id(website_id),
+        index idx_website_id_display_order(website_id, display_order)
     );
 ''',
 r'''
@@ -176,7 +177,8 @@ r'''
         modified_time real not null,
         version bigint not null,
         primary key(id),
-        index idx_website_id(website_id)
+        index idx_website_id(website_id),
+        index idx_website_id_display_order(website_id, display_order, name)
     );
 ''',
 r'''
@@ -197,7 +199,10 @@ r'''
         version bigint not null,
         primary key(id),
         index idx_website_id(website_id),
+        index idx_website_id_draft(website_id, draft),
+        index idx_website_id_draft_modified_time(website_id, draft, modified_time),
         index idx_category_id(category_id),
+        index idx_category_id_draft(category_id, draft),
         index idx_user_id(user_id)
     );
 ''',
@@ -224,7 +229,8 @@ r'''
         modified_time real not null,
         version bigint not null,
         primary key(id),
-        index idx_website_id(website_id)
+        index idx_website_id(website_id),
+        index idx_website_id_draft(website_id, draft)
     );
 ''',
 r'''-- not init in db yet
@@ -253,11 +259,13 @@ r'''
         name varchar(100) not null,
         description varchar(100) not null,
         content mediumtext not null,
+        read_count bigint not null,
         creation_time real not null,
         modified_time real not null,
         version bigint not null,
         primary key(id),
-        index idx_website_id(website_id)
+        index idx_website_id(website_id),
+        index idx_website_id_name(website_id, name)
     );
 ''',
 r'''
@@ -269,12 +277,33 @@ r'''
         display_order int not null,
         name varchar(100) not null,
         content mediumtext not null,
+        read_count bigint not null,
         creation_time real not null,
         modified_time real not null,
         version bigint not null,
         primary key(id),
         index idx_website_id(website_id),
-        index idx_wiki_id(wiki_id)
+        index idx_wiki_id(wiki_id),
+        index idx_wiki_id_parent_id(wiki_id, parent_id)
+    );
+''',
+r'''
+    create table wiki_navs (
+        id varchar(50) not null,
+        website_id varchar(50) not null,
+        content mediumtext not null,
+        creation_time real not null,
+        primary key(id)
+    );
+''',
+r'''
+    create table rendered_htmls (
+        id varchar(50) not null,
+        ref_type varchar(50) not null,
+        version bigint not null,
+        content mediumtext not null,
+        creation_time real not null,
+        primary key(id)
     );
 ''',
 r'''-- not init in db yet
@@ -5,24 +5,63 @@ __author__ = 'Michael Liao'
 
 ' Loader module that load modules dynamic. '
 
-import os, logging, functools
+import os, time, logging, functools
 
 from transwarp.web import ctx, forbidden, notfound
 from transwarp import db, i18n
 
 from auth import extract_session_cookie, http_basic_auth
-from apiexporter import cached
+import lru, generation
+
+# process-local map of host -> website, and set of unknown hosts which is
+# small so a flood of random hosts cannot evict websites:
+_SITE_TIMEOUT = 300
+_SITE_NOT_FOUND_TIMEOUT = 10
+_SITE_GENERATION_INTERVAL = 5.0
+
+_SITE_GENERATION = 'websites'
+
+_sites = lru.LRUCache(max_items=10000, timeout=_SITE_TIMEOUT)
+_unknown_hosts = lru.LRUCache(max_items=1000, timeout=_SITE_NOT_FOUND_TIMEOUT)
+_site_generation = [0, 0.0]
+
+def _check_site_generation():
+    ' clear local websites if generation was bumped by any process, checked every few seconds. '
+    now = time.time()
+    if now - _site_generation[1] < _SITE_GENERATION_INTERVAL:
+        return
+    _site_generation[1] = now
+    gen = generation.get(_SITE_GENERATION)
+    if gen!=_site_generation[0]:
+        _site_generation[0] = gen
+        _sites.clear()
+        _unknown_hosts.clear()
+
+def invalidate_sites():
+    '''
+    Invalidate cached websites of all processes after a website was created,
+    updated, enabled or disabled.
+    '''
+    _site_generation[0] = generation.bump(_SITE_GENERATION)
+    _sites.clear()
+    _unknown_hosts.clear()
 
-@cached(key='website', use_ctx=False)
 def _get_site(host):
-    wss = db.select('select * from websites where domain=?', host)
-    if wss:
+    _check_site_generation()
+    if host in _unknown_hosts:
+        raise notfound()
+    ws = _sites.get(host)
+    if ws is None:
+        wss = db.select('select * from websites where domain=?', host)
+        if not wss:
+            _unknown_hosts.set(host, True)
+            raise notfound()
         ws = wss[0]
-        if ws.disabled:
-            logging.debug('website is disabled: %s' % host)
-            raise forbidden()
-        return ws
-    raise notfound()
+        _sites.set(host, ws)
+    if ws.disabled:
+        logging.debug('website is disabled: %s' % host)
+        raise forbidden()
+    return ws
 
 def load_site(func):
     @functools.wraps(func)
@@ -60,14 +99,23 @@ def load_user(func):
             del ctx.user
     return _wrapper
 
+def parse_locale(accept_language):
+    '''
+    Get locale from value of header 'Accept-Language'.
+
+    >>> parse_locale('zh-CN,zh;q=0.8,en;q=0.6')
+    'zh-cn'
+    >>> parse_locale('')
+    'en'
+    '''
+    if accept_language:
+        return accept_language.split(',')[0].strip().lower()
+    return 'en'
+
 def load_i18n(func):
     @functools.wraps(func)
     def _wrapper(*args, **kw):
-        lc = 'en'
-        al = ctx.request.header('ACCEPT-LANGUAGE')
-        if al:
-            lcs = al.split(',')
-            lc = lcs[0].strip().lower()
+        lc = parse_locale(ctx.request.header('ACCEPT-LANGUAGE'))
         with i18n.locale(lc):
             return func(*args, **kw)
     return _wrapper
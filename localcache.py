@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+In-process cache clients with the same interface as cache.RedisClient.
+
+LocalClient keeps values in an LRU bounded by bytes, and is used as cache of a
+single-process site, tests and benchmarks:
+
+    cache.client = localcache.LocalClient(max_bytes=64 * 1024 * 1024)
+
+NearClient caches values of a remote client in process for a few seconds, while
+counters, and keys that are deleted or overwritten in place (rows, users,
+locks), always go to the remote client, so a value replaced by other process
+is never served from near cache:
+
+    cache.client = localcache.NearClient(cache.RedisClient('localhost'))
+
+Values are stored by reference, so wrap the client by codec.CodecClient which
+stores values as str if the returned values may be modified.
+'''
+
+import lru
+
+_NEAR_TIMEOUT = 5
+
+# prefixes of keys that are invalidated by delete or set without version:
+NEAR_EXCLUDED_PREFIXES = ('__ROW__@', '__USER__@', '__LOCK__@', '__COUNTER', '__GENERATION__@')
+
+class LocalClient(object):
+    '''
+    Cache client that stores values in process.
+
+    >>> c = LocalClient()
+    >>> c.set('a', 'hello')
+    >>> c.get('a'), c.get('b'), c.get('b', 'default')
+    ('hello', None, 'default')
+    >>> c.gets('a', 'b')
+    ['hello', None]
+    >>> c.incr('n'), c.incr('n', 5), c.decr('n')
+    (1, 6, 5)
+    >>> c.getint('n'), c.getint('x')
+    (5, None)
+    >>> c.getints(['n', 'x'])
+    [5, None]
+    >>> sorted(c.incrs(dict(n=2, m=-1)))
+    [-1, 7]
+    >>> c.getints(['n', 'm'])
+    [7, -1]
+    >>> c.delete('a')
+    >>> c.get('a') is None
+    True
+    >>> import time
+    >>> c.set('t', 'expires', 0.1)
+    >>> time.sleep(0.2)
+    >>> c.get('t') is None
+    True
+    >>> c.incrs(dict(lock=1), 0.1), c.incr('lock')
+    ([1], 2)
+    >>> time.sleep(0.2)
+    >>> c.getint('lock') is None
+    True
+    '''
+
+    def __init__(self, max_items=0, max_bytes=64 * 1024 * 1024):
+        self._cache = lru.LRUCache(max_items=max_items, max_bytes=max_bytes)
+
+    def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    def gets(self, *keys):
+        return [self._cache.get(key) for key in keys]
+
+    def set(self, key, value, timeout=0):
+        self._cache.set(key, value, timeout)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+    def incr(self, key, delta=1):
+        # an existing counter keeps its timeout:
+        return self._cache.incr(key, delta, 0)
+
+    def decr(self, key, delta=1):
+        return self.incr(key, -delta)
+
+    def incrs(self, deltas, timeout=0):
+        '''
+        Increase counters by deltas as dict of key -> delta, and return new
+        values as list. If timeout > 0, new counters expire after timeout seconds.
+        '''
+        return [self._cache.incr(key, delta, timeout) for key, delta in deltas.iteritems()]
+
+    def getint(self, key):
+        n = self._cache.get(key)
+        return None if n is None else int(n)
+
+    def getints(self, keys):
+        return [self.getint(key) for key in keys]
+
+    def stats(self):
+        return self._cache.stats()
+
+class NearClient(object):
+    '''
+    Cache client that caches values of remote client in process for timeout
+    seconds. Only keys versioned by generation or content should be cached in
+    process: keys starting with excluded prefixes always go to remote client.
+    Counters are not cached in process.
+
+    >>> c = NearClient(LocalClient())
+    >>> c.set('__ROW__@articles:1', 'v1')
+    >>> c.set('__HTML__@articles:1:1', 'h1')
+    >>> c.gets('__ROW__@articles:1', '__HTML__@articles:1:1')
+    ['v1', 'h1']
+    >>> c._remote.set('__ROW__@articles:1', 'v2')
+    >>> c.get('__ROW__@articles:1')
+    'v2'
+    '''
+
+    def __init__(self, remote, timeout=_NEAR_TIMEOUT, max_items=0, max_bytes=64 * 1024 * 1024, excluded_prefixes=NEAR_EXCLUDED_PREFIXES):
+        self._remote = remote
+        self._local = lru.LRUCache(max_items=max_items, max_bytes=max_bytes, timeout=timeout)
+        self._excluded = tuple(excluded_prefixes)
+
+    def _is_near(self, key):
+        return not key.startswith(self._excluded)
+
+    def __getattr__(self, name):
+        # incr, decr, getint, getints and others go to remote client:
+        return getattr(self._remote, name)
+
+    def get(self, key, default=None):
+        r = self._local.get(key) if self._is_near(key) else None
+        if r is None:
+            r = self._remote.get(key)
+            if r is None:
+                return default
+            if self._is_near(key):
+                self._local.set(key, r)
+        return r
+
+    def gets(self, *keys):
+        L = [self._local.get(key) if self._is_near(key) else None for key in keys]
+        missing = [n for n, r in enumerate(L) if r is None]
+        if missing:
+            for n, r in zip(missing, self._remote.gets(*[keys[n] for n in missing])):
+                if r is not None:
+                    if self._is_near(keys[n]):
+                        self._local.set(keys[n], r)
+                    L[n] = r
+        return L
+
+    def set(self, key, value, *args, **kw):
+        if self._is_near(key):
+            self._local.set(key, value)
+        return self._remote.set(key, value, *args, **kw)
+
+    def delete(self, key):
+        self._local.delete(key)
+        return self._remote.delete(key)
+
+    def stats(self):
+        return self._local.stats()
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+' In-process LRU cache bounded by number of items and bytes of values. '
+
+import sys, time, threading
+from collections import OrderedDict
+
+def _sizeof(value):
+    if isinstance(value, (str, unicode)):
+        return len(value)
+    return sys.getsizeof(value)
+
+class LRUCache(object):
+    '''
+    A thread-safe LRU cache. Least recently used items are evicted when the
+    number of items exceeds max_items, or total size of values exceeds max_bytes.
+    Items expire after timeout seconds if timeout > 0.
+
+    >>> c = LRUCache(max_items=2)
+    >>> c.set('a', 1)
+    >>> c.set('b', 2)
+    >>> c.get('a')
+    1
+    >>> c.set('c', 3)
+    >>> c.get('b') is None
+    True
+    >>> c.get('a'), c.get('c')
+    (1, 3)
+    >>> s = c.stats()
+    >>> s['hits'], s['misses'], s['evictions'], s['items']
+    (3, 1, 1, 2)
+    >>> c = LRUCache(max_bytes=10)
+    >>> c.set('x', 'abcdef')
+    >>> c.set('y', 'ghijkl')
+    >>> 'x' in c, 'y' in c
+    (False, True)
+    >>> c.set('z', 'too long value')
+    >>> 'z' in c
+    False
+    >>> c = LRUCache(timeout=0.1)
+    >>> c.set('t', 'expires')
+    >>> c.get('t')
+    'expires'
+    >>> time.sleep(0.2)
+    >>> c.get('t', 'default')
+    'default'
+    >>> c.incr('n', 1, 0.1), c.incr('n', 2, 10)
+    (1, 3)
+    >>> time.sleep(0.2)
+    >>> c.get('n') is None
+    True
+    '''
+
+    def __init__(self, max_items=0, max_bytes=0, timeout=0, sizeof=_sizeof):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._timeout = timeout
+        self._sizeof = sizeof
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and (item[2]==0 or item[2] > time.time())
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                self.misses = self.misses + 1
+                return default
+            if item[2] and item[2] <= time.time():
+                self._bytes = self._bytes - item[1]
+                self.misses = self.misses + 1
+                return default
+            self._data[key] = item
+            self.hits = self.hits + 1
+            return item[0]
+
+    def set(self, key, value, timeout=None):
+        size = self._sizeof(value) if self._max_bytes else 0
+        if self._max_bytes and size > self._max_bytes:
+            self.delete(key)
+            return
+        t = self._timeout if timeout is None else timeout
+        expires = time.time() + t if t else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes = self._bytes - old[1]
+            self._data[key] = (value, size, expires)
+            self._bytes = self._bytes + size
+            self._evict()
+
+    def incr(self, key, delta=1, timeout=None):
+        '''
+        Increase int value of key by delta and return the new value. An existing
+        item keeps its expiry time, and a new item expires after timeout seconds.
+        '''
+        now = time.time()
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self._bytes = self._bytes - item[1]
+                if item[2] and item[2] <= now:
+                    item = None
+            if item is None:
+                t = self._timeout if timeout is None else timeout
+                n, expires = delta, (now + t if t else 0)
+            else:
+                n, expires = int(item[0]) + delta, item[2]
+            size = self._sizeof(n) if self._max_bytes else 0
+            self._data[key] = (n, size, expires)
+            self._bytes = self._bytes + size
+            self._evict()
+            return n
+
+    def _evict(self):
+        while (self._max_items and len(self._data) > self._max_items) or (self._max_bytes and self._bytes > self._max_bytes):
+            k, item = self._data.popitem(last=False)
+            self._bytes = self._bytes - item[1]
+            self.evictions = self.evictions + 1
+
+    def delete(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self._bytes = self._bytes - item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, items=len(self._data), bytes=self._bytes)
+
+if __name__=='__main__':
+    import doctest
+    doctest.testmod()
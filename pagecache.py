@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Full-page output cache for anonymous requests of themed routes.
+
+A themed route opts in by @theme('article.html', page_cache=True). When the
+request is anonymous, the theme marks the response with header X-Page-Cache,
+and PageCacheMiddleware stores the rendered page by host, path, query string
+and locale. A cached page is valid until the generation of its website is
+bumped by any write of articles, categories, navigations, settings or themes.
+
+A page is stored with its gzip compressed bytes, so a hot page is compressed
+only once and served as is to clients that accept gzip.
+'''
+
+import logging
+
+from transwarp.web import ctx
+from transwarp import cache
+
+import generation, counter, loader, conditional, compress
+from auth import _SESSION_COOKIE_NAME
+
+_PAGE_KEY = '__PAGE__@%s:%s?%s@%s'
+_PAGE_TIMEOUT = 3600
+
+_HEADER_MARK = 'X-Page-Cache'
+_HEADER_COUNTERS = 'X-Page-Cache-Counters'
+
+def _generation_name(website_id):
+    return 'page:%s' % website_id
+
+def get_generation(website_id=None):
+    '''
+    Get page generation of website, default to current website. The generation
+    is read once per request, so everything rendered by a request uses the same
+    generation.
+    '''
+    wid = website_id or ctx.website.id
+    request = getattr(ctx, 'request', None)
+    memo = getattr(ctx, 'page_generation', None)
+    if memo and request is not None and memo[0] is request and memo[1]==wid:
+        return memo[2]
+    gen = generation.get(_generation_name(wid))
+    ctx.page_generation = (request, wid, gen)
+    return gen
+
+def bump(website_id=None):
+    '''
+    Invalidate all cached pages of website, default to current website.
+    '''
+    wid = website_id or ctx.website.id
+    logging.debug('bump page generation of website: %s' % wid)
+    generation.bump(_generation_name(wid))
+    ctx.page_generation = None
+
+def mark(counters=()):
+    '''
+    Mark current response as cacheable. The counters as list of (key, table) are 
+    increased for every request served from cache.
+    '''
+    wid = ctx.website.id
+    gen = get_generation(wid)
+    ctx.response.set_header(_HEADER_MARK, '%s:%s' % (wid, gen))
+    if counters:
+        ctx.response.set_header(_HEADER_COUNTERS, ','.join(['%s:%s' % (table or '', key) for key, table in counters]))
+
+def _is_anonymous(environ):
+    if environ.get('HTTP_AUTHORIZATION'):
+        return False
+    return not ('%s=' % _SESSION_COOKIE_NAME) in environ.get('HTTP_COOKIE', '')
+
+def _page_key(environ):
+    host = environ.get('HTTP_HOST', '').lower()
+    n = host.find(':')
+    if n!=(-1):
+        host = host[:n]
+    lc = loader.parse_locale(environ.get('HTTP_ACCEPT_LANGUAGE'))
+    return _PAGE_KEY % (host, environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', ''), lc)
+
+class PageCacheMiddleware(object):
+    '''
+    WSGI middleware that serves and stores pages marked by mark().
+    '''
+
+    def __init__(self, app, timeout=_PAGE_TIMEOUT):
+        self._app = app
+        self._timeout = timeout
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD')!='GET' or not _is_anonymous(environ):
+            return self._app(environ, start_response)
+        key = _page_key(environ)
+        page = cache.client.get(key)
+        if page is not None and len(page)==7:
+            wid, gen, status, headers, body, gzbody, counters = page
+            if gen==generation.get(_generation_name(wid)):
+                logging.debug('page cache hit: %s' % key)
+                for key, table in counters:
+                    counter.inc(key, table)
+                etag = dict(headers).get('ETag')
+                if etag and conditional.etag_matches(environ.get('HTTP_IF_NONE_MATCH'), etag):
+                    start_response('304 Not Modified', [('ETag', etag)])
+                    return []
+                if gzbody is not None and compress.accepts_gzip(environ):
+                    start_response(status, compress.gzip_headers(headers, len(gzbody)))
+                    return [gzbody]
+                start_response(status, headers)
+                return [body]
+        captured = []
+        def _start_response(status, headers, exc_info=None):
+            captured.append((status, headers))
+            return start_response(status, [h for h in headers if not h[0].startswith(_HEADER_MARK)], exc_info)
+        r = self._app(environ, _start_response)
+        if not captured:
+            return r
+        status, headers = captured[0]
+        hdict = dict(headers)
+        mark = hdict.get(_HEADER_MARK)
+        if not mark or not status.startswith('200'):
+            return r
+        body = ''.join(r)
+        if hasattr(r, 'close'):
+            r.close()
+        wid, gen = mark.rsplit(':', 1)
+        counters = [tuple(reversed(c.split(':', 1))) for c in hdict.get(_HEADER_COUNTERS, '').split(',') if c]
+        counters = [(key, table or None) for key, table in counters]
+        headers = [h for h in headers if not h[0].startswith(_HEADER_MARK) and h[0].lower()!='set-cookie']
+        gzbody = compress.gzip_bytes(body) if len(body) >= compress.MIN_SIZE and compress.is_compressible(headers) else None
+        cache.client.set(key, (wid, int(gen), status, headers, body, gzbody, counters), self._timeout)
+        return [body]
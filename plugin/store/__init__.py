@@ -44,7 +44,7 @@ from datetime import datetime
 from transwarp.web import ctx, Dict
 from transwarp import db
 
-import setting, loader, plugin
+import setting, loader, plugin, rowcache
 
 _KIND = 'plugin.store'
 _KEY = 'enabled'
@@ -69,7 +69,9 @@ def get_enabled_store_instance():
     return get_store_instance(get_enabled_store_name())
 
 def delete_resources(ref_id):
+    ids = [r.id for r in db.select('select id from resources where ref_id=?', ref_id)]
     db.update('update resources set deleted=? where ref_id=?', True, ref_id)
+    rowcache.delete('resources', *ids)
 
 def delete_file(the_ref):
     ss = the_ref.split(':', 1)
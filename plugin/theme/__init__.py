@@ -7,7 +7,7 @@ import os, logging, functools
 
 from transwarp.web import ctx, Template
 
-import setting, loader
+import setting, loader, pagecache, assets
 
 _KIND_THEME = 'theme'
 _KEY_THEME = 'active_theme'
@@ -37,8 +37,7 @@ def get_themes():
     return _themes
 
 def get_active_theme():
-    s = setting.get_setting(_KIND_THEME, _KEY_THEME)
-    return s or 'default'
+    return setting.get_snapshot_setting(_KIND_THEME, _KEY_THEME, 'default')
 
 def set_active_theme(theme_id):
     for t in get_themes():
@@ -51,25 +50,32 @@ def _init_theme(path, model):
     theme = get_active_theme()
     model['__theme_path__'] = '/plugin/theme/%s' % theme
     model['__get_theme_path__'] = lambda _templpath: 'plugin/theme/%s/%s' % (theme, _templpath)
+    model['__get_assets__'] = lambda _name: assets.get_urls(theme, _name)
     model['__custom_header__'] = setting.get_text(setting.KIND_WEBSITE, 'custom_header')
     model['__custom_footer__'] = setting.get_text(setting.KIND_WEBSITE, 'custom_footer')
     model['__menus__'] = []
     model['__settings__'] = setting.get_website_settings()
-    model['__navigations__'] = loader.load_navigations()
+    model['__navigations__'] = setting.get_snapshot().navigations
     model['__website__'] = ctx.website
     model['__user__'] = ctx.user
     model['__ctx__'] = ctx
     return 'plugin/theme/%s/%s' % (theme, path), model
 
-def theme(path):
+def theme(path, page_cache=False):
     '''
     ThemeTemplate uses 'plugin/theme/<active-theme>' + template path to get real template.
+
+    If page_cache is True, the rendered page is cached for anonymous user, and 
+    counters in model['__counters__'] as (key, table) are increased when page is 
+    served from cache.
     '''
     def _decorator(func):
         @functools.wraps(func)
         def _wrapper(*args, **kw):
             r = func(*args, **kw)
             if isinstance(r, dict):
+                if page_cache and ctx.user is None:
+                    pagecache.mark(r.get('__counters__', ()))
                 templ_path, model = _init_theme(path, r)
                 return Template(templ_path, model)
             return r
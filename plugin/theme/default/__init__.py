@@ -5,3 +5,8 @@ name = 'Default'
 description = 'Default theme for iTranswarp.'
 author = 'Michael Liao'
 url = 'http://www.itranswarp.com/'
+
+bundles = {
+    'css/site.css': ['css/bootstrap.css', 'css/responsive.css', 'css/custom.css'],
+    'js/site.js': ['js/jquery-1.9.0.min.js', 'js/bootstrap.min.js'],
+}
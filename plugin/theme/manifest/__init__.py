@@ -5,3 +5,8 @@ name = 'Manifest'
 description = 'A clean and streamlined theme that focused on the content and not the distractions.'
 author = 'Jim Barraud'
 url = 'http://themes.jimbarraud.com/manifest/'
+
+bundles = {
+    'css/site.css': ['css/reset.css', 'css/custom.css'],
+    'js/site.js': ['js/jquery-1.9.0.min.js'],
+}
@@ -5,3 +5,8 @@ name = 'Metro'
 description = 'A metro-style theme with 3D flip effect.'
 author = ''
 url = ''
+
+bundles = {
+    'css/site.css': ['css/reset.css', 'css/metro.css'],
+    'js/site.js': ['js/jquery-1.9.0.min.js', 'js/metro.js'],
+}
@@ -5,3 +5,8 @@ name = 'WpCartoons'
 description = 'A wp-cartoons style theme.'
 author = ''
 url = ''
+
+bundles = {
+    'css/site.css': ['css/reset.css', 'css/cartoons.css'],
+    'js/site.js': ['js/jquery-1.9.0.min.js', 'js/cartoon.js'],
+}
@@ -5,3 +5,8 @@ name = 'WpTech'
 description = 'A wp-tech style theme.'
 author = ''
 url = ''
+
+bundles = {
+    'css/site.css': ['css/reset.css', 'css/wptech.css'],
+    'js/site.js': ['js/jquery-1.9.0.min.js', 'js/wptech.js'],
+}
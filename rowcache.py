@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Read-through cache of rows by (table, id).
+
+Rows are cached in process for a few seconds, and in cache for a few minutes.
+Missing ids are cached too so probing dead urls does not hit db. Any update or
+delete of a cached table must call delete(table, *ids) after the change:
+
+    db.update_kw('articles', 'id=?', article_id, **kw)
+    rowcache.delete('articles', article_id)
+
+Rows cached in process are keyed by the page generation of current website,
+so after a write that bumps the generation, no process renders a page or makes
+an ETag by an old row of its process. Outside of a request of website, rows are
+not cached in process. Other writes, e.g. folding read counts, may be seen by
+other processes after at most _LOCAL_ROW_TIMEOUT seconds.
+'''
+
+from transwarp.web import ctx, Dict
+from transwarp import db, cache
+
+import lru, pagecache
+
+_ROW_KEY = '__ROW__@%s:%s'
+_ROW_TIMEOUT = 600
+_MISSING_TIMEOUT = 60
+_LOCAL_ROW_TIMEOUT = 5
+
+# marker of missing row, which is stored as empty str in cache:
+_MISSING = ''
+
+_local_rows = lru.LRUCache(max_items=10000, max_bytes=64 * 1024 * 1024, timeout=_LOCAL_ROW_TIMEOUT)
+
+def _local_keys(keys):
+    '''
+    Get keys of rows cached in process with page generation of current website,
+    or None if not in a request of website.
+    '''
+    if getattr(ctx, 'website', None) is None:
+        return None
+    gen = pagecache.get_generation()
+    return ['%s#%s' % (key, gen) for key in keys]
+
+def get(table, row_id):
+    '''
+    Get row by id as a copy that can be modified, or None if not found.
+    '''
+    return gets(table, row_id)[0]
+
+def gets(table, *ids):
+    '''
+    Get rows by ids as list, with None for missing rows. Rows not cached in
+    process are fetched from cache by one call, and then from db by one query.
+    '''
+    keys = [_ROW_KEY % (table, row_id) for row_id in ids]
+    local_keys = _local_keys(keys)
+    L = [_local_rows.get(key) for key in local_keys] if local_keys else [None] * len(keys)
+    missing = [n for n, r in enumerate(L) if r is None]
+    if missing:
+        shared = cache.client.gets(*[keys[n] for n in missing])
+        for n, r in zip(missing, shared):
+            if r is not None:
+                if local_keys:
+                    _local_rows.set(local_keys[n], r)
+                L[n] = r
+        missing = [n for n in missing if L[n] is None]
+    if missing:
+        rows = db.select('select * from %s where id in (%s)' % (table, ', '.join(['?'] * len(missing))), *[ids[n] for n in missing])
+        d = dict(((r.id, r) for r in rows))
+        for n in missing:
+            r = d.get(ids[n], _MISSING)
+            cache.client.set(keys[n], r, _MISSING_TIMEOUT if r is _MISSING else _ROW_TIMEOUT)
+            if local_keys:
+                _local_rows.set(local_keys[n], r)
+            L[n] = r
+    return [Dict(**r) if r else None for r in L]
+
+def delete(table, *ids):
+    ' delete cached rows after rows were updated or deleted. '
+    local_keys = _local_keys([_ROW_KEY % (table, row_id) for row_id in ids])
+    for n, row_id in enumerate(ids):
+        if local_keys:
+            _local_rows.delete(local_keys[n])
+        cache.client.delete(_ROW_KEY % (table, row_id))
+
+def get_cache_stats():
+    '''
+    Get hit, miss and eviction counters of rows cached in process as dict.
+    '''
+    return _local_rows.stats()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Michael Liao'
+
+'''
+Schema migration of tables and indexes, and an index advisor that explains
+registered query shapes against a database.
+
+Usage:
+
+python schema.py migrate   # create missing tables, add missing columns and indexes
+python schema.py explain   # report full scans and filesorts of query shapes
+'''
+
+import re, logging
+
+from transwarp import db
+
+from install import CREATE_TABLES
+
+# indexes as (table, index name, columns) that must exist.
+# NOTE: InnoDB appends primary key id to every secondary index, so an index of
+# (website_id, draft) also serves 'where website_id=? and draft=? order by id'.
+INDEXES = [
+    ('articles', 'idx_website_id_draft', ('website_id', 'draft')),
+    ('articles', 'idx_category_id_draft', ('category_id', 'draft')),
+    ('articles', 'idx_website_id_draft_modified_time', ('website_id', 'draft', 'modified_time')),
+    ('pages', 'idx_website_id_draft', ('website_id', 'draft')),
+    ('categories', 'idx_website_id_display_order', ('website_id', 'display_order', 'name')),
+    ('navigations', 'idx_website_id_display_order', ('website_id', 'display_order')),
+    ('wikis', 'idx_website_id_name', ('website_id', 'name')),
+    ('wiki_pages', 'idx_wiki_id_parent_id', ('wiki_id', 'parent_id')),
+]
+
+# columns as (table, column, definition) added after tables were created:
+COLUMNS = [
+    ('wikis', 'read_count', 'bigint not null default 0'),
+    ('wiki_pages', 'read_count', 'bigint not null default 0'),
+]
+
+def sample(table, column):
+    ' make a sample arg of query shape, which is a value of column selected from table. '
+    def _sample():
+        r = db.select_one('select %s from %s limit 1' % (column, table))
+        return r[column]
+    return _sample
+
+# query shapes as (name, sql, args) issued by apps:
+QUERY_SHAPES = [
+    ('articles of website', 'select * from articles where website_id=? and draft=? order by id desc limit ?', [sample('articles', 'website_id'), False, 21]),
+    ('articles of website after cursor', 'select * from articles where website_id=? and draft=? and id < ? order by id desc limit ?', [sample('articles', 'website_id'), False, sample('articles', 'id'), 21]),
+    ('all articles of website', 'select * from articles where website_id=? order by id desc limit ?', [sample('articles', 'website_id'), 51]),
+    ('articles of category', 'select * from articles where category_id=? and draft=? order by id desc limit ?', [sample('articles', 'category_id'), False, 21]),
+    ('last modified of articles', 'select max(modified_time) as last_modified from articles where website_id=? and draft=?', [sample('articles', 'website_id'), False]),
+    ('count of articles', 'select count(id) from articles where website_id=? and draft=?', [sample('articles', 'website_id'), False]),
+    ('pages of website', 'select * from pages where website_id=? and draft=? order by id desc', [sample('pages', 'website_id'), False]),
+    ('attachments of website', 'select * from attachments where website_id=? order by id desc limit ?', [sample('attachments', 'website_id'), 21]),
+    ('categories of website', 'select * from categories where website_id=? order by display_order, name', [sample('categories', 'website_id')]),
+    ('navigations of website', 'select * from navigations where website_id=? order by display_order', [sample('navigations', 'website_id')]),
+    ('settings of kind', 'select name, value from settings where kind=? and website_id=?', [sample('settings', 'kind'), sample('settings', 'website_id')]),
+    ('texts of kind', 'select name, value from texts where kind=? and website_id=?', [sample('texts', 'kind'), sample('texts', 'website_id')]),
+    ('wikis of website', 'select * from wikis where website_id=? order by name, id', [sample('wikis', 'website_id')]),
+    ('pages of wiki', 'select id, website_id, wiki_id, parent_id, display_order, name, version from wiki_pages where wiki_id=?', [sample('wiki_pages', 'wiki_id')]),
+    ('children of wiki page', 'select count(id) from wiki_pages where wiki_id=? and parent_id=?', [sample('wiki_pages', 'wiki_id'), sample('wiki_pages', 'parent_id')]),
+    ('rendered html', 'select content from rendered_htmls where id=? and version=?', [sample('rendered_htmls', 'id'), sample('rendered_htmls', 'version')]),
+]
+
+_RE_CREATE_TABLE = re.compile(r'^\s*create\s+table\s+(\w+)', re.IGNORECASE)
+
+def migrate_tables():
+    '''
+    Create tables of install.CREATE_TABLES that do not exist yet.
+
+    Returns:
+        list of created table names.
+    '''
+    tables = set([r.values()[0] for r in db.select('show tables')])
+    created = []
+    for sql in CREATE_TABLES:
+        if sql.startswith('--'):
+            continue
+        m = _RE_CREATE_TABLE.match(sql)
+        if m and not m.group(1) in tables:
+            logging.info('create table %s...' % m.group(1))
+            db.update(sql)
+            created.append(m.group(1))
+    return created
+
+def migrate_columns():
+    '''
+    Add columns that do not exist yet.
+
+    Returns:
+        list of added column as 'table.column'.
+    '''
+    added = []
+    existing = dict()
+    for table, name, definition in COLUMNS:
+        if not table in existing:
+            existing[table] = set([r.Field for r in db.select('show columns from %s' % table)])
+        if name in existing[table]:
+            continue
+        logging.info('add column %s to table %s...' % (name, table))
+        db.update('alter table %s add column %s %s' % (table, name, definition))
+        existing[table].add(name)
+        added.append('%s.%s' % (table, name))
+    return added
+
+def _get_index_names(table):
+    return set([r.Key_name for r in db.select('show index from %s' % table)])
+
+def migrate_indexes():
+    '''
+    Add indexes that do not exist yet.
+
+    Returns:
+        list of added index as 'table.index'.
+    '''
+    added = []
+    existing = dict()
+    for table, name, columns in INDEXES:
+        if not table in existing:
+            existing[table] = _get_index_names(table)
+        if name in existing[table]:
+            continue
+        logging.info('add index %s to table %s...' % (name, table))
+        db.update('alter table %s add index %s(%s)' % (table, name, ', '.join(columns)))
+        existing[table].add(name)
+        added.append('%s.%s' % (table, name))
+    return added
+
+def _is_bad_plan(r):
+    ' test if a row of EXPLAIN is a full scan or needs filesort / temporary table. '
+    extra = r.get('Extra') or ''
+    return r.get('type')=='ALL' or 'filesort' in extra or 'temporary' in extra
+
+def explain_shapes():
+    '''
+    Explain all query shapes.
+
+    Returns:
+        list of (name, sql, bad rows of EXPLAIN) for shapes with bad plans.
+    '''
+    reports = []
+    for name, sql, args in QUERY_SHAPES:
+        try:
+            values = [a() if callable(a) else a for a in args]
+        except TypeError, e:
+            logging.warning('skip query shape "%s": no sample data.' % name)
+            continue
+        bad = [r for r in db.select('explain %s' % sql, *values) if _is_bad_plan(r)]
+        if bad:
+            reports.append((name, sql, bad))
+    return reports
+
+if __name__=='__main__':
+    import sys
+    if not sys.argv[1:] in (['migrate'], ['explain']):
+        print 'Usage: python schema.py migrate|explain'
+        exit(1)
+    import conf_prod
+    db.init(db_type = conf_prod.db.get('type', 'mysql'), \
+            db_schema = conf_prod.db.get('schema', 'itranswarp'), \
+            db_host = conf_prod.db.get('host', 'localhost'), \
+            db_port = conf_prod.db.get('port', 3306), \
+            db_user = conf_prod.db.get('user', 'www-data'), \
+            db_password = conf_prod.db.get('password', 'www-data'), \
+            use_unicode = True, charset = 'utf8')
+    if sys.argv[1]=='migrate':
+        for s in migrate_tables():
+            print 'created table: %s' % s
+        for s in migrate_columns():
+            print 'added column: %s' % s
+        for s in migrate_indexes():
+            print 'added index: %s' % s
+        exit(0)
+    reports = explain_shapes()
+    for name, sql, rows in reports:
+        print '%s:\n  %s' % (name, sql)
+        for r in rows:
+            print '  table=%s, type=%s, key=%s, rows=%s, extra=%s' % (r.get('table'), r.get('type'), r.get('key'), r.get('rows'), r.get('Extra'))
+    print '%d of %d query shapes have full scan or filesort.' % (len(reports), len(QUERY_SHAPES))
@@ -7,11 +7,86 @@ __author__ = 'Michael Liao'
 
 import time, base64, logging
 
-from transwarp.web import ctx
+from transwarp.web import ctx, Dict
 from transwarp import db, cache
 
+import lru, generation, pagecache
+
 _GLOBAL = '__global__'
 
+################################################################################
+# Snapshot of settings, texts and navigations of website
+################################################################################
+
+_SNAPSHOT_KEY = '__SETTINGS__@%s:%d'
+_SNAPSHOT_TIMEOUT = 3600
+
+_snapshots = lru.LRUCache(max_items=1000, timeout=_SNAPSHOT_TIMEOUT)
+
+def _snapshot_generation_name(website_id):
+    return 'settings:%s' % website_id
+
+def _load_snapshot(website_id):
+    L = db.select("select 's' as src, id, name, value, 0 as display_order, kind from settings where website_id=? " \
+                  "union all select 't' as src, id, name, value, 0 as display_order, kind from texts where website_id=? " \
+                  "union all select 'n' as src, id, name, url as value, display_order, kind from navigations where website_id=?", \
+                  website_id, website_id, website_id)
+    snapshot = Dict(settings=dict(), texts=dict(), navigations=[])
+    for r in L:
+        if r.src=='s':
+            snapshot.settings[r.name] = r.value
+        elif r.src=='t':
+            snapshot.texts[r.name] = r.value
+        else:
+            snapshot.navigations.append(Dict(id=r.id, kind=r.kind, name=r.name, url=r.value, display_order=r.display_order))
+    snapshot.navigations.sort(key=lambda n: n.display_order)
+    return snapshot
+
+def get_snapshot(website_id=None):
+    '''
+    Get snapshot of current website as Dict with settings and texts (dict of 
+    name -> value) and navigations (list ordered by display_order). The snapshot 
+    is loaded by one query, and cached in process and in cache until 
+    invalidate_snapshot() is called. The snapshot is also kept in ctx, so the 
+    generation is read from cache only once per request.
+    '''
+    wid = website_id or ctx.website.id
+    request = getattr(ctx, 'request', None)
+    memo = getattr(ctx, 'settings_snapshot', None)
+    if memo and request is not None and memo[0] is request and memo[1]==wid:
+        return memo[2]
+    gen = generation.get(_snapshot_generation_name(wid))
+    key = _SNAPSHOT_KEY % (wid, gen)
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        snapshot = cache.client.get(key)
+        if snapshot is None:
+            snapshot = _load_snapshot(wid)
+            cache.client.set(key, snapshot, _SNAPSHOT_TIMEOUT)
+        _snapshots.set(key, snapshot)
+    ctx.settings_snapshot = (request, wid, snapshot)
+    return snapshot
+
+def invalidate_snapshot(website_id=None):
+    '''
+    Invalidate snapshot of website, default to current website, and all cached pages.
+    '''
+    wid = website_id or ctx.website.id
+    generation.bump(_snapshot_generation_name(wid))
+    ctx.settings_snapshot = None
+    pagecache.bump(wid)
+
+def _get_snapshot_settings(kind):
+    prefix = '%s:' % kind
+    l = len(prefix)
+    return dict(((k[l:], v) for k, v in get_snapshot().settings.iteritems() if k.startswith(prefix)))
+
+def get_snapshot_setting(kind, key, default=u''):
+    '''
+    Get setting of current website by kind and key from snapshot.
+    '''
+    return get_snapshot().settings.get('%s:%s' % (kind, key)) or default
+
 def set_text(kind, key, value):
     '''
     Set text by kind, key and value.
@@ -31,27 +106,13 @@ def set_text(kind, key, value):
         version = 0)
     db.update('delete from texts where name=? and website_id=?', name, ctx.website.id)
     db.insert('texts', **text)
-    cache.client.delete('TEXT:%s:%s:%s' % (ctx.website.id, kind, key))
-
-def _get_text(website_id, kind, key, default):
-    ss = db.select('select value from texts where name=? and website_id=?', '%s:%s' % (kind, key), website_id)
-    if ss:
-        v = ss[0].value
-        if v:
-            return v
-    return default
+    invalidate_snapshot()
 
 def get_text(kind, key, default=u''):
     '''
     Get text by kind and key. Return default value u'' if not exist.
     '''
-    cache_key = 'TEXT:%s:%s:%s' % (ctx.website.id, kind, key)
-    r = cache.client.get(cache_key)
-    if r is not None:
-        return r
-    r = _get_text(ctx.website.id, kind, key, default)
-    cache.client.set(cache_key, r, 3600)
-    return r
+    return get_snapshot().texts.get('%s:%s' % (kind, key)) or default
 
 def _get_setting(website_id, kind, key, default=u''):
     ss = db.select('select value from settings where name=? and website_id=?', '%s:%s' % (kind, key), website_id)
@@ -110,6 +171,7 @@ def _set_setting(website_id, kind, key, value):
         version = 0)
     db.update('delete from settings where name=? and website_id=?', name, website_id)
     db.insert('settings', **settings)
+    invalidate_snapshot(website_id)
 
 def set_setting(kind, key, value):
     _set_setting(ctx.website.id, kind, key, value)
@@ -117,13 +179,15 @@ def set_setting(kind, key, value):
 def set_global_setting(kind, key, value):
     _set_setting(_GLOBAL, kind, key, value)
 
-@db.with_transaction
 def _set_settings(website_id, kind, **kw):
     '''
     set settings by kind and key-value pair.
     '''
-    for k, v in kw.iteritems():
-        _set_setting(website_id, kind, k, v)
+    with db.transaction():
+        for k, v in kw.iteritems():
+            _set_setting(website_id, kind, k, v)
+    # invalidate again in case snapshot was loaded before transaction committed:
+    invalidate_snapshot(website_id)
 
 def set_settings(kind, **kw):
     _set_settings(ctx.website.id, kind, **kw)
@@ -134,6 +198,7 @@ def set_global_settings(kind, **kw):
 def _delete_setting(website_id, kind, key):
     name = '%s:%s' % (kind, key)
     db.update('delete from settings where name=? and website_id=?', name, website_id)
+    invalidate_snapshot(website_id)
 
 def delete_setting(kind, key):
     _delete_setting(ctx.website.id, kind, key)
@@ -143,6 +208,7 @@ def delete_global_setting(kind, key):
 
 def _delete_settings(website_id, kind):
     db.update('delete from settings where kind=? and website_id=?', kind, website_id)
+    invalidate_snapshot(website_id)
 
 def delete_settings(kind):
     _delete_settings(ctx.website.id, kind)
@@ -218,7 +284,7 @@ TIMEZONES = [
 ]
 
 def get_website_settings():
-    d = get_settings(KIND_WEBSITE)
+    d = _get_snapshot_settings(KIND_WEBSITE)
     if not WEBSITE_DESCRIPTION in d:
         d[WEBSITE_DESCRIPTION] = u''
     if not WEBSITE_COPYRIGHT in d:
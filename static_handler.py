@@ -6,33 +6,174 @@ __author__ = 'Michael Liao'
 '''
 Handle static file with url '.../static/...'.
 
-It is ONLY used in developement. You should use web server (e.g. nginx) to handle static file.
+It is used in development, and in production without web server (e.g. nginx)
+in front if conf.static['serve'] is True. Files are sent by wsgi.file_wrapper
+if the server supports it, with Last-Modified, Cache-Control and Range
+support. Fingerprinted assets (e.g. site.3f2a9c1d.css) and uploaded files
+are cached by browsers forever.
 '''
 
-import os, logging, mimetypes
+import os, re, mimetypes
 
 from transwarp.web import ctx, get, HttpError
 
-def _static_file_generator(fpath):
-    BLOCK_SIZE = 8192
+import lru
+from conditional import http_date, not_modified_since
+
+BLOCK_SIZE = 8192
+
+_MAX_AGE_FOREVER = 'public, max-age=31536000, immutable'
+_MAX_AGE_DEFAULT = 'public, max-age=300'
+
+_RE_FINGERPRINT = re.compile(r'\.[0-9a-f]{8,}\.\w+$')
+
+# stat results as fpath -> (size, mtime), or None if file not found:
+_stats = lru.LRUCache(max_items=4096, timeout=10)
+
+def _stat(fpath):
+    st = _stats.get(fpath, False)
+    if st is False:
+        st = None
+        if os.path.isfile(fpath):
+            s = os.stat(fpath)
+            st = (s.st_size, s.st_mtime)
+        _stats.set(fpath, st)
+    return st
+
+def _is_immutable(pathinfo):
+    '''
+    Test if file never changes.
+
+    >>> _is_immutable('/static/upload/123/attachment/2013/1/2/8f14e45fceea167a5a36dedd4bea2543.jpg')
+    True
+    >>> _is_immutable('/plugin/theme/default/static/css/site.3f2a9c1d.css')
+    True
+    >>> _is_immutable('/static/css/site.css')
+    False
+    '''
+    return pathinfo.startswith('/static/upload/') or _RE_FINGERPRINT.search(pathinfo) is not None
+
+_RE_STATIC_PATH = re.compile(r'^/(static|plugin/theme/\w+/static)/')
+
+def _is_allowed(pathinfo):
+    '''
+    Test if path is a file under /static/ or static directory of a theme.
+
+    >>> _is_allowed('/static/css/site.css')
+    True
+    >>> _is_allowed('/plugin/theme/default/static/js/html5.js')
+    True
+    >>> _is_allowed('/x/static/../../conf_prod.py')
+    False
+    >>> _is_allowed('/plugin/static/a.js')
+    False
+    >>> _is_allowed('/static//etc/passwd')
+    False
+    '''
+    if _RE_STATIC_PATH.match(pathinfo) is None:
+        return False
+    for seg in pathinfo.split('/')[1:]:
+        if seg in ('', '.', '..') or '\\' in seg:
+            return False
+    return True
+
+def parse_range(value, size):
+    '''
+    Parse header Range of single byte range as (start, end) inclusive, or None
+    if header is not a byte range. Raise ValueError if range is not satisfiable.
+
+    >>> parse_range('bytes=0-99', 1000)
+    (0, 99)
+    >>> parse_range('bytes=900-', 1000)
+    (900, 999)
+    >>> parse_range('bytes=-100', 1000)
+    (900, 999)
+    >>> parse_range('bytes=500-2000', 1000)
+    (500, 999)
+    >>> parse_range('bytes=0-1,5-6', 1000) is None
+    True
+    >>> parse_range('bytes=1000-', 1000)
+    Traceback (most recent call last):
+      ...
+    ValueError: range not satisfiable.
+    '''
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    s, sep, e = value[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if s:
+            start = int(s)
+            end = int(e) if e else size - 1
+        else:
+            start = size - int(e)
+            end = size - 1
+    except ValueError:
+        return None
+    start = max(start, 0)
+    end = min(end, size - 1)
+    if start > end:
+        raise ValueError('range not satisfiable.')
+    return start, end
+
+def _static_file_generator(fpath, start=0, length=None):
     with open(fpath, 'rb') as f:
-        block = f.read(BLOCK_SIZE)
-        while block:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            block = f.read(BLOCK_SIZE if remaining is None else min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            if remaining is not None:
+                remaining = remaining - len(block)
             yield block
-            block = f.read(BLOCK_SIZE)
+
+@get('/static/<path:file>')
+def static_upload_handler(file):
+    return _send_file()
 
 @get('/<path:pre>/static/<path:file>')
 def static_file_handler(pre, file):
+    return _send_file()
+
+def _send_file():
     pathinfo = ctx.request.path_info
-    if not pathinfo.startswith('/'):
+    if not _is_allowed(pathinfo):
+        raise HttpError('403')
+    root = ctx.application.document_root
+    fpath = os.path.normpath(os.path.join(root, pathinfo[1:]))
+    # normalized path must be still under static directory of pathinfo:
+    static_dir = os.path.join(root, *_RE_STATIC_PATH.match(pathinfo).group(1).split('/'))
+    if not fpath.startswith(os.path.join(static_dir, '')):
         raise HttpError('403')
-    fpath = os.path.join(ctx.application.document_root, pathinfo[1:])
-    logging.info('static file: %s' % fpath)
-    if not os.path.isfile(fpath):
+    st = _stat(fpath)
+    if st is None:
         raise HttpError(404)
+    size, mtime = st
     fext = os.path.splitext(fpath)[1]
     ctx.response.content_type = mimetypes.types_map.get(fext.lower(), 'application/octet-stream')
-    ctx.response.content_length = os.path.getsize(fpath)
+    ctx.response.set_header('Last-Modified', http_date(mtime))
+    ctx.response.set_header('Cache-Control', _MAX_AGE_FOREVER if _is_immutable(pathinfo) else _MAX_AGE_DEFAULT)
+    ctx.response.set_header('Accept-Ranges', 'bytes')
+    if not_modified_since(ctx.request.header('IF-MODIFIED-SINCE'), mtime):
+        ctx.response.status = 304
+        return []
+    try:
+        r = parse_range(ctx.request.header('RANGE'), size)
+    except ValueError:
+        ctx.response.set_header('Content-Range', 'bytes */%d' % size)
+        raise HttpError(416)
+    if r:
+        start, end = r
+        ctx.response.status = 206
+        ctx.response.set_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        ctx.response.content_length = end - start + 1
+        return _static_file_generator(fpath, start, end - start + 1)
+    ctx.response.content_length = size
+    file_wrapper = ctx.request.environ.get('wsgi.file_wrapper')
+    if file_wrapper:
+        return file_wrapper(open(fpath, 'rb'), BLOCK_SIZE)
     return _static_file_generator(fpath)
 
 if __name__=='__main__':
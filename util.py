@@ -70,6 +70,132 @@ def get_comments_desc(ref_id, max_results=20, after_id=None):
         return db.select('select * from comments where ref_id=? and id < ? order by id desc limit ?', ref_id, after_id, max_results)
     return db.select('select * from comments where ref_id=? order by id desc limit ?', ref_id, max_results)
 
+def bulk_update(table, column, values, increment=False, sets=None):
+    '''
+    Update column of many rows by id in one statement:
+
+      update table set column = case id when ? then ? ... end where id in (?, ...)
+
+    Args:
+        table: table name.
+        column: column name.
+        values: dict of id -> value.
+        increment: add value to column instead of setting it.
+        sets: extra assignments without args, e.g. 'version = version + 1'.
+    Returns:
+        number of updated rows.
+    '''
+    if not values:
+        return 0
+    ids = values.keys()
+    args = []
+    for i in ids:
+        args.append(i)
+        args.append(values[i])
+    args.extend(ids)
+    cases = 'case id %s end' % ' '.join(['when ? then ?'] * len(ids))
+    expr = '%s + %s' % (column, cases) if increment else cases
+    if sets:
+        expr = '%s, %s' % (expr, sets)
+    return db.update('update %s set %s = %s where id in (%s)' % (table, column, expr, ','.join(['?'] * len(ids))), *args)
+
+def upsert(table, **kw):
+    '''
+    Insert a row, or update all other columns if a row of the same primary key
+    exists, in one statement, so concurrent writers never fail by duplicate key:
+
+      insert into table (id, ...) values (?, ...) on duplicate key update c = values(c), ...
+
+    Returns:
+        number of affected rows.
+    '''
+    cols = kw.keys()
+    updates = ', '.join(['%s = values(%s)' % (c, c) for c in cols if c!='id'])
+    sql = 'insert into %s (%s) values (%s) on duplicate key update %s' % (table, ', '.join(cols), ', '.join(['?'] * len(cols)), updates)
+    return db.update(sql, *[kw[c] for c in cols])
+
+def changed_orders(rows, ids, column='display_order'):
+    '''
+    Get new orders as dict of id -> order, for rows whose order is changed by 
+    position in ids.
+
+    >>> rows = [Dict(id='a', display_order=0), Dict(id='b', display_order=1), Dict(id='c', display_order=2)]
+    >>> sorted(changed_orders(rows, ['a', 'c', 'b']).items())
+    [('b', 2), ('c', 1)]
+    >>> changed_orders(rows, ['a', 'b', 'c'])
+    {}
+    '''
+    current = dict(((r.id, r[column]) for r in rows))
+    return dict(((i, n) for n, i in enumerate(ids) if current.get(i)!=n))
+
+def reorder(table, rows, ids, column='display_order', sets=None, batch=500):
+    '''
+    Set order of rows by position in ids, and only update rows whose order is 
+    changed, by one statement per batch.
+
+    Args:
+        table: table name.
+        rows: current rows with id and order column.
+        ids: ids in new order.
+        column: order column name.
+        sets: extra assignments for changed rows, e.g. 'version = version + 1'.
+        batch: max rows updated by one statement.
+    Returns:
+        number of changed rows.
+    '''
+    items = changed_orders(rows, ids, column).items()
+    for pos in range(0, len(items), batch):
+        bulk_update(table, column, dict(items[pos:pos + batch]), sets=sets)
+    return len(items)
+
+def select_page(table, where, args, size, page=1, after=None, before=None, desc=True, columns='*'):
+    '''
+    Select a page of rows ordered by id. Rows are selected by keyset pagination
+    if cursor after or before is given, otherwise by offset of page index.
+
+    Args:
+        table: table name.
+        where: where clause without 'where', e.g. 'website_id=?', or '' for all rows.
+        args: args of where clause as list.
+        size: page size.
+        page: page index from 1, only used for offset and display if cursor is given.
+        after: select rows after the row of this id.
+        before: select rows before the row of this id.
+        desc: order by id desc.
+        columns: selected columns, e.g. 'id, name', which must contain id.
+    Returns:
+        rows as list, and paging info as dict with page, previous and next, while
+        previous and next are query strings of the previous and next page, or None.
+    '''
+    conds = [where] if where else []
+    args = list(args)
+    if before:
+        conds.append('id %s ?' % ('>' if desc else '<'))
+        args.extend([before, size + 1])
+        L = db.select('select %s from %s where %s order by id %s limit ?' % (columns, table, ' and '.join(conds), 'asc' if desc else 'desc'), *args)
+        has_previous = len(L) > size
+        L = L[:size]
+        L.reverse()
+        has_next = True
+        if not has_previous:
+            page = 1
+    else:
+        if after:
+            conds.append('id %s ?' % ('<' if desc else '>'))
+            args.extend([after, size + 1])
+            limit = 'limit ?'
+        else:
+            args.extend([(page - 1) * size, size + 1])
+            limit = 'limit ?,?'
+        where_clause = 'where %s ' % ' and '.join(conds) if conds else ''
+        L = db.select('select %s from %s %sorder by id %s %s' % (columns, table, where_clause, 'desc' if desc else 'asc', limit), *args)
+        has_previous = bool(after) or page > 1
+        has_next = len(L) > size
+        L = L[:size]
+    previous = 'before=%s&page=%d' % (L[0].id, max(page - 1, 1)) if has_previous and L else None
+    next = 'after=%s&page=%d' % (L[-1].id, page + 1) if has_next and L else None
+    return L, dict(page=page, previous=previous, next=next)
+
 def get_comments(ref_id, page_index=1, page_size=20):
     '''
     Get comments by page.
@@ -15,6 +15,10 @@ from transwarp import i18n; i18n.install_i18n(); i18n.load_i18n('i18n/zh_cn.txt'
 from transwarp import web, db, cache
 
 from loader import load_site, load_user, load_i18n
+from pagecache import PageCacheMiddleware
+from compress import GzipMiddleware
+
+import cacheclient, assets, counter
 
 def create_app(debug):
     if debug:
@@ -28,18 +32,19 @@ def create_app(debug):
         db_host=conf.db['host'], db_port=conf.db['port'], \
         db_user=conf.db['user'], db_password=conf.db['password'], \
         use_unicode=True, charset='utf8')
+    # use source files of theme assets in development:
+    assets.debug = debug
     # init cache:
-    if conf.cache['type']=='redis':
-        host = conf.cache.get('host', 'localhost')
-        cache.client = cache.RedisClient(host)
-    if conf.cache['type']=='memcache':
-        host = conf.cache.get('host', 'localhost')
-        cache.client = cache.MemcacheClient(host)
+    cache.client = cacheclient.create_client(conf.cache)
+    if conf.cache['type']=='local':
+        # counters in process cache are lost if not folded by this process:
+        counter.start_folding()
     scan = ['apps.article', 'apps.wiki', 'apps.website', 'auth', 'admin']
-    if debug:
+    if debug or getattr(conf, 'static', dict()).get('serve', False):
         scan.append('static_handler')
-    return web.WSGIApplication(scan, \
+    app = web.WSGIApplication(scan, \
             document_root=os.path.dirname(os.path.abspath(__file__)), \
             filters=(load_site, load_user, load_i18n), \
             template_engine='jinja2', \
             DEBUG=debug)
+    return GzipMiddleware(PageCacheMiddleware(app))